@@ -0,0 +1,21 @@
+from django.apps import AppConfig
+
+
+class PurchaseConfig(AppConfig):
+    name = 'apps.purchase'
+
+    def ready(self):
+        from . import signals  # noqa
+        from . import autocomplete_index, views
+
+        # here rather than in views, so the index doesn't depend on the urls being loaded
+        autocomplete_index.register(
+            self.get_model('Product'),
+            ('identifier', 'name', 'name_short', 'search_name'),
+            views.get_product_autocomplete_row
+        )
+        autocomplete_index.register(
+            self.get_model('Supplier'),
+            ('name', 'city', 'email'),
+            views.get_supplier_autocomplete_row
+        )
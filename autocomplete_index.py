@@ -0,0 +1,269 @@
+"""
+In-process prefix indexes for the autocomplete actions.
+
+Each index is a sorted list of (text, pk) keys, one key per word offset of every indexed field, plus the
+prebuilt autocomplete row per pk. Indexes are built lazily per tenant schema and patched from the model
+signals. A version counter in the cache tells other server processes to rebuild theirs; one thread rebuilds
+while the others keep searching the previous index.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+
+_registry = {}
+_indexes = {}
+_lock = threading.RLock()
+# one rebuild at a time per (label, schema name)
+_build_locks = defaultdict(threading.Lock)
+
+_whitespace = re.compile(r'\s+')
+
+
+def is_enabled():
+    return getattr(settings, 'PURCHASE_AUTOCOMPLETE_INDEX', False)
+
+
+def get_cache():
+    return caches[getattr(settings, 'PURCHASE_AUTOCOMPLETE_CACHE', 'default')]
+
+
+def normalize(value):
+    return _whitespace.sub(' ', ('%s' % value).lower()).strip()
+
+
+def get_keys(value):
+    """
+    the text from every word start onwards, so a query matches the start of any word
+    """
+    value = normalize(value)
+    keys = []
+
+    if value:
+        keys.append(value)
+
+        for match in _whitespace.finditer(value):
+            keys.append(value[match.end():])
+
+    return keys
+
+
+def _get_pk_keys(pk, values):
+    keys = set()
+    for value in values:
+        if value:
+            keys.update((key, pk) for key in get_keys(value))
+
+    return keys
+
+
+class PrefixIndex(object):
+    def __init__(self):
+        self._keys = []
+        self._pk_keys = {}
+        self._rows = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def load(self, entries):
+        """
+        add (pk, values, row) entries in one go, sorting the keys once
+        """
+        with self._lock:
+            for pk, values, row in entries:
+                self._pk_keys[pk] = _get_pk_keys(pk, values)
+                self._rows[pk] = row
+
+            self._keys = sorted(key for keys in self._pk_keys.values() for key in keys)
+
+    def add(self, pk, values, row):
+        with self._lock:
+            self.remove(pk)
+
+            keys = _get_pk_keys(pk, values)
+            for key in keys:
+                insort(self._keys, key)
+
+            self._pk_keys[pk] = keys
+            self._rows[pk] = row
+
+    def remove(self, pk):
+        with self._lock:
+            for key in self._pk_keys.pop(pk, ()):
+                i = bisect_left(self._keys, key)
+                if i < len(self._keys) and self._keys[i] == key:
+                    del self._keys[i]
+
+            self._rows.pop(pk, None)
+
+    def search(self, query, limit):
+        query = normalize(query)
+        result = []
+        seen = set()
+
+        with self._lock:
+            i = bisect_left(self._keys, (query,))
+            while i < len(self._keys) and len(result) < limit:
+                text, pk = self._keys[i]
+                if not text.startswith(query):
+                    break
+
+                if pk not in seen:
+                    seen.add(pk)
+                    result.append(self._rows[pk])
+
+                i += 1
+
+        return result
+
+
+def register(model, fields, get_row, get_queryset=None):
+    """
+    index model on fields, get_row(instance) builds the autocomplete row
+    """
+    _registry[model._meta.label_lower] = {
+        'fields': fields,
+        'get_row': get_row,
+        'get_queryset': get_queryset or model._default_manager.all,
+    }
+
+
+def _version_key(label, schema_name):
+    return 'purchase-autocomplete-version:%s:%s' % (label, schema_name)
+
+
+def _new_version():
+    # start from the clock so an evicted counter never reuses an old version
+    return int(time.time() * 1000)
+
+
+def _get_version(label, schema_name):
+    return get_cache().get_or_set(_version_key(label, schema_name), _new_version, None)
+
+
+def _build(label):
+    registration = _registry[label]
+    index = PrefixIndex()
+
+    index.load(
+        (
+            instance.pk,
+            [getattr(instance, field) for field in registration['fields']],
+            registration['get_row'](instance)
+        )
+        for instance in registration['get_queryset']().iterator()
+    )
+
+    return index
+
+
+def get_index(model):
+    label = model._meta.label_lower
+    schema_name = connection.schema_name
+    version = _get_version(label, schema_name)
+
+    with _lock:
+        built = _indexes.get((label, schema_name))
+        build_lock = _build_locks[(label, schema_name)]
+
+    if built is not None and built[0] == version:
+        return built[1]
+
+    # while another thread rebuilds, search the index we have, or wait for the first one
+    if not build_lock.acquire(blocking=built is None):
+        return built[1]
+
+    try:
+        with _lock:
+            built = _indexes.get((label, schema_name))
+        if built is not None and built[0] == version:
+            return built[1]
+
+        index = _build(label)
+
+        with _lock:
+            _indexes[(label, schema_name)] = (version, index)
+
+        return index
+    finally:
+        build_lock.release()
+
+
+def search(model, query, limit):
+    return get_index(model).search(query, limit)
+
+
+def _apply(label, schema_name, instance, deleted):
+    cache = get_cache()
+    key = _version_key(label, schema_name)
+
+    try:
+        version = cache.incr(key)
+    except ValueError:
+        version = _new_version()
+        cache.set(key, version, None)
+
+    with _lock:
+        built = _indexes.get((label, schema_name))
+        if built is None:
+            return
+
+        if built[0] != version - 1:
+            # another process changed the data too, rebuild on the next search
+            del _indexes[(label, schema_name)]
+            return
+
+        index = built[1]
+        registration = _registry[label]
+
+        if deleted:
+            index.remove(instance.pk)
+        else:
+            index.add(
+                instance.pk,
+                [getattr(instance, field) for field in registration['fields']],
+                registration['get_row'](instance)
+            )
+
+        _indexes[(label, schema_name)] = (version, index)
+
+
+def changed(instance, deleted=False):
+    """
+    patch the local index and invalidate the others once the change is committed
+    """
+    if not is_enabled():
+        return
+
+    label = instance._meta.label_lower
+    schema_name = connection.schema_name
+
+    transaction.on_commit(lambda: _apply(label, schema_name, instance, deleted))
+
+
+def invalidate(model):
+    """
+    rebuild the index of model on the next search, for changes that sent no signals like bulk inserts
+    """
+    if not is_enabled():
+        return
+
+    label = model._meta.label_lower
+    schema_name = connection.schema_name
+    cache = get_cache()
+    key = _version_key(label, schema_name)
+
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), None)
+
+    with _lock:
+        _indexes.pop((label, schema_name), None)
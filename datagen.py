@@ -0,0 +1,276 @@
+import datetime
+import io
+import logging
+import random
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from tenant_schemas.utils import get_public_schema_name, get_tenant_model, schema_context
+
+from apps.order.models import Order, OrderLine
+from . import autocomplete_index
+from . import jobs
+from . import models
+from . import report_cache
+
+logger = logging.getLogger('apps.purchase')
+
+WORDS = ('bolt', 'nut', 'screw', 'washer', 'pipe', 'valve', 'pump', 'filter', 'hose', 'clamp', 'seal', 'ring',
+         'cable', 'switch', 'relay', 'fuse', 'panel', 'sensor', 'motor', 'belt', 'bearing', 'gear', 'spring', 'plate')
+CITIES = ('Amsterdam', 'Rotterdam', 'Utrecht', 'Eindhoven', 'Groningen', 'Tilburg', 'Almere', 'Breda', 'Nijmegen')
+UNITS = ('piece', 'box', 'meter', 'liter', 'kg')
+PRODUCT_TYPES = ('part', 'tool', 'consumable', 'service')
+
+DEFAULTS = {
+    'seed': 0,
+    'suppliers': 1000,
+    'products': 100000,
+    'locations': 50,
+    'inventory': 50000,
+    'mutations': 100000,
+    'customers': 1000,
+    'orderlines': 1000000,
+    'lines_per_order': 10,
+    'batch_size': 5000,
+    'copy': False,
+}
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+
+    return ('%s' % value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_insert(model, objs):
+    """
+    insert objs with COPY, without returning their ids
+    """
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    content = io.StringIO()
+
+    for obj in objs:
+        values = [field.get_db_prep_save(field.pre_save(obj, True), connection) for field in fields]
+        content.write('\t'.join(_copy_value(value) for value in values))
+        content.write('\n')
+
+    content.seek(0)
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+
+    with connection.cursor() as cursor:
+        cursor.copy_expert('COPY %s (%s) FROM STDIN' % (connection.ops.quote_name(model._meta.db_table), columns),
+                           content)
+
+
+class Generator(object):
+    """
+    random but reproducible purchase data for the current schema, inserted in batches
+    """
+    def __init__(self, **options):
+        self.options = dict(DEFAULTS, **{key: value for key, value in options.items() if value is not None})
+        self.random = random.Random(self.options['seed'])
+        self.batch_size = self.options['batch_size']
+        self.use_copy = self.options['copy'] and connection.vendor == 'postgresql'
+        self.counts = {}
+
+    def insert(self, model, objs, returning=False):
+        """
+        store a batch, returns the ids when returning is set
+        """
+        if self.use_copy and not returning:
+            copy_insert(model, objs)
+        else:
+            objs = model.objects.bulk_create(objs, batch_size=self.batch_size)
+
+        self.counts[model.__name__] = self.counts.get(model.__name__, 0) + len(objs)
+
+        return [obj.pk for obj in objs] if returning else None
+
+    def batches(self, total, build, model, returning=False, inserted=None):
+        """
+        build and insert total rows, inserted(objs) runs in the transaction of every batch
+        """
+        ids = []
+
+        for start in range(0, total, self.batch_size):
+            objs = [build(i) for i in range(start, min(start + self.batch_size, total))]
+
+            with transaction.atomic():
+                batch_ids = self.insert(model, objs, returning=returning)
+                if inserted is not None:
+                    inserted(objs)
+
+            if returning:
+                ids.extend(batch_ids)
+
+            logger.info('%s: %s %d/%d', connection.schema_name, model.__name__, start + len(objs), total)
+
+        return ids
+
+    def apply_mutations(self, mutations):
+        """
+        book a batch of mutations on the inventory, like StockMutation.save() does for a single one
+        """
+        deltas = {}
+        for mutation in mutations:
+            for key, amount in mutation.get_inventory_deltas().items():
+                deltas[key] = deltas.get(key, 0) + amount
+
+        models.StockLocationInventory.objects.adjust(deltas)
+
+    def money(self, low, high):
+        return Decimal(self.random.randint(low * 100, high * 100)) / 100
+
+    def words(self, count):
+        return ' '.join(self.random.choice(WORDS) for i in range(count))
+
+    def build_supplier(self, i):
+        return models.Supplier(
+            identifier='S%07d' % i,
+            name='%s %d' % (self.words(2).title(), i),
+            address='%s %d' % (self.words(1).title(), self.random.randint(1, 300)),
+            postal='%04d AB' % self.random.randint(1000, 9999),
+            city=self.random.choice(CITIES),
+            email='supplier%d@example.com' % i,
+        )
+
+    def build_product(self, i):
+        price_purchase = self.money(1, 500)
+        price_selling = (price_purchase * Decimal('1.4')).quantize(Decimal('0.01'))
+
+        return models.Product(
+            identifier='P%07d' % i,
+            name='%s %d' % (self.words(3), i),
+            name_short=self.words(1),
+            search_name=self.words(2),
+            unit=self.random.choice(UNITS),
+            supplier='%s %d' % (self.words(1).title(), self.random.randrange(self.options['suppliers'] or 1)),
+            product_type=self.random.choice(PRODUCT_TYPES),
+            price_purchase=price_purchase,
+            price_selling=price_selling,
+            price_selling_alt=price_selling,
+            price_purchase_ex=price_purchase,
+            price_selling_ex=price_selling,
+            price_selling_alt_ex=price_selling,
+        )
+
+    def build_location(self, i):
+        return models.StockLocation(identifier='L%04d' % i, name='%s %d' % (self.random.choice(CITIES), i))
+
+    def generate(self):
+        options = self.options
+
+        self.batches(options['suppliers'], self.build_supplier, models.Supplier)
+        products = self.batches(options['products'], self.build_product, models.Product, returning=True)
+        locations = self.batches(options['locations'], self.build_location, models.StockLocation, returning=True)
+
+        if not products or not locations:
+            return self.counts
+
+        # one row per (product, location), walking the products first
+        inventory = min(options['inventory'], len(products) * len(locations))
+        self.batches(inventory, lambda i: models.StockLocationInventory(
+            product_id=products[i % len(products)],
+            location_id=locations[i // len(products)],
+            amount=self.random.randint(0, 500),
+        ), models.StockLocationInventory)
+
+        def build_mutation(i):
+            mutation_type = self.random.choice(('sales', 'purchase', 'move'))
+
+            return models.StockMutation(
+                product_id=self.random.choice(products),
+                fromLocation_id=self.random.choice(locations) if mutation_type != 'purchase' else None,
+                toLocation_id=self.random.choice(locations) if mutation_type != 'sales' else None,
+                mutationType=mutation_type,
+                amount=self.random.randint(1, 20),
+            )
+
+        self.batches(options['mutations'], build_mutation, models.StockMutation, inserted=self.apply_mutations)
+
+        today = timezone.now().date()
+        lines_per_order = max(options['lines_per_order'], 1)
+
+        def build_order(i):
+            customer = self.random.randrange(max(options['customers'], 1))
+            day = today - datetime.timedelta(days=self.random.randrange(730))
+
+            return Order(
+                customer_id='%d' % customer,
+                order_name='Customer %d' % customer,
+                start_date=day,
+                end_date=day,
+                order_type='sales',
+            )
+
+        order_count = -(-options['orderlines'] // lines_per_order)
+        orders = self.batches(order_count, build_order, Order, returning=True)
+
+        def build_orderline(i):
+            price_purchase = self.money(1, 500)
+
+            return OrderLine(
+                order_id=orders[i // lines_per_order],
+                product_relation_id=self.random.choice(products),
+                location_relation_id=self.random.choice(locations),
+                amount=self.random.randint(1, 10),
+                price_purchase=price_purchase,
+                price_selling=(price_purchase * Decimal('1.4')).quantize(Decimal('0.01')),
+            )
+
+        self.batches(options['orderlines'], build_orderline, OrderLine)
+
+        # bulk inserts skip the signals that keep these up to date
+        if models.SalesRollup.objects.is_enabled():
+            models.SalesRollup.objects.rebuild(batch_size=self.batch_size)
+        report_cache.invalidate()
+        autocomplete_index.invalidate(models.Product)
+        autocomplete_index.invalidate(models.Supplier)
+
+        return self.counts
+
+
+def generate_schema(schema_name, options):
+    """
+    fill one tenant schema, module level so a process pool can run it
+    """
+    with schema_context(schema_name):
+        return schema_name, Generator(**options).generate()
+
+
+def get_schema_names():
+    public = get_public_schema_name()
+
+    return list(get_tenant_model().objects.exclude(schema_name=public).values_list('schema_name', flat=True))
+
+
+def generate(schema_names, options, processes=1):
+    """
+    fill the schemas, each with its own seed, in a pool of processes; yields (schema name, counts)
+    """
+    arguments = [
+        (schema_name, dict(options, seed=options.get('seed', 0) + i))
+        for i, schema_name in enumerate(schema_names)
+    ]
+
+    if processes <= 1 or len(arguments) <= 1:
+        for schema_name, schema_options in arguments:
+            yield generate_schema(schema_name, schema_options)
+        return
+
+    # the workers open their own connections
+    connection.close()
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=jobs.init_process) as executor:
+        for result in executor.map(generate_schema, *zip(*arguments)):
+            yield result
@@ -0,0 +1,37 @@
+import tempfile
+from wsgiref.util import FileWrapper
+
+from django.http import StreamingHttpResponse
+from openpyxl import Workbook
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def write_xlsx(fileobj, headers, rows):
+    """
+    write rows (dicts) to fileobj with a write-only workbook, rows are flushed to disk as they are added
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(headers)
+
+    for row in rows:
+        sheet.append([row.get(header) for header in headers])
+
+    workbook.save(fileobj)
+
+
+def xlsx_response(filename, headers, rows, chunk_size=64 * 1024):
+    """
+    build the workbook in a temporary file and stream it to the client in chunks
+    """
+    fileobj = tempfile.TemporaryFile()
+    write_xlsx(fileobj, headers, rows)
+    size = fileobj.tell()
+    fileobj.seek(0)
+
+    response = StreamingHttpResponse(FileWrapper(fileobj, chunk_size), content_type=XLSX_CONTENT_TYPE)
+    response['Content-Length'] = size
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+
+    return response
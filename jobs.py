@@ -0,0 +1,147 @@
+import logging
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, connections
+from django.utils import timezone
+
+from tenant_schemas.utils import schema_context
+
+logger = logging.getLogger('apps.purchase')
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class SyncExecutor(object):
+    """
+    runs jobs right away in the calling thread, for tests and development
+    """
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as exc:
+            future.set_exception(exc)
+
+        return future
+
+
+def init_process():
+    """
+    initializer of a ProcessPoolExecutor whose workers use the database
+    """
+    if not apps.ready:
+        django.setup()
+
+    # forked workers must not reuse the database sockets of the parent
+    for conn in connections.all():
+        conn.connection = None
+
+
+def get_backend():
+    return getattr(settings, 'PURCHASE_JOB_BACKEND', 'thread')
+
+
+def get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            backend = get_backend()
+            workers = getattr(settings, 'PURCHASE_JOB_WORKERS', 2)
+
+            if backend == 'sync':
+                _executor = SyncExecutor()
+            elif backend == 'process':
+                _executor = ProcessPoolExecutor(max_workers=workers, initializer=init_process)
+            elif backend == 'thread':
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='purchase-job')
+            else:
+                raise ValueError('unknown PURCHASE_JOB_BACKEND: %s' % backend)
+
+    return _executor
+
+
+def get_cache():
+    return caches[getattr(settings, 'PURCHASE_JOB_CACHE', 'default')]
+
+
+def get_ttl():
+    return getattr(settings, 'PURCHASE_JOB_TTL', 3600)
+
+
+def _cache_key(job_id):
+    return 'purchase-job:%s' % job_id
+
+
+def _run(schema_name, close_connection, fn, args, kwargs):
+    try:
+        with schema_context(schema_name):
+            return fn(*args, **kwargs)
+    finally:
+        if close_connection:
+            connection.close()
+
+
+def _finish(job, future):
+    try:
+        job['result'] = future.result()
+        job['status'] = DONE
+    except Exception:
+        logger.exception('purchase job %s failed', job['id'])
+        job['status'] = FAILED
+
+    job['finished'] = timezone.now()
+    get_cache().set(_cache_key(job['id']), job, get_ttl())
+
+
+def submit(fn, *args, user=None, **kwargs):
+    """
+    run fn(*args, **kwargs) in the background for the current tenant, returns the job
+
+    fn must be a module level function when the process backend is used.
+    """
+    job = {
+        'id': uuid.uuid4().hex,
+        'status': PENDING,
+        'schema_name': connection.schema_name,
+        'user_id': user.pk if user else None,
+        'created': timezone.now(),
+        'finished': None,
+        'result': None,
+    }
+
+    get_cache().set(_cache_key(job['id']), job, get_ttl())
+
+    close_connection = get_backend() != 'sync'
+    future = get_executor().submit(_run, job['schema_name'], close_connection, fn, args, kwargs)
+    future.add_done_callback(partial(_finish, dict(job)))
+
+    return get_job(job['id'], user=user) or job
+
+
+def get_job(job_id, user=None):
+    """
+    the job, if it exists and belongs to the current tenant and user
+    """
+    job = get_cache().get(_cache_key(job_id))
+
+    if job is None or job['schema_name'] != connection.schema_name:
+        return None
+
+    if user is not None and job['user_id'] != user.pk:
+        return None
+
+    return job
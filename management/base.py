@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tenant_schemas.utils import schema_context
+
+from apps.purchase import datagen
+
+
+class TenantCommand(BaseCommand):
+    """
+    runs handle_schema() in every tenant schema, or in the ones given with --schema
+    """
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', action='append', dest='schemas',
+                            help='tenant schema to run in, can be repeated, defaults to all tenants')
+
+    def handle(self, *args, **options):
+        schema_names = options['schemas'] or datagen.get_schema_names()
+        if not schema_names:
+            raise CommandError('no tenant schemas')
+
+        for schema_name in schema_names:
+            with schema_context(schema_name):
+                message = self.handle_schema(**options)
+
+            self.stdout.write(self.style.SUCCESS('%s: %s' % (schema_name, message)))
+
+    def handle_schema(self, **options):
+        """
+        the work for the current schema, returns the line to report
+        """
+        raise NotImplementedError
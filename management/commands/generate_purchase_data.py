@@ -0,0 +1,39 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from apps.purchase import datagen
+
+
+class Command(BaseCommand):
+    help = 'Generate random purchase data: products, suppliers, locations, inventory, mutations and sales orderlines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', action='append', dest='schemas',
+                            help='tenant schema to fill, can be repeated, defaults to all tenants')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help='schemas filled in parallel')
+        parser.add_argument('--seed', type=int, default=datagen.DEFAULTS['seed'])
+        parser.add_argument('--batch-size', type=int, default=datagen.DEFAULTS['batch_size'])
+        parser.add_argument('--copy', action='store_true',
+                            help='insert rows that need no ids back with PostgreSQL COPY instead of bulk_create')
+
+        for name in ('suppliers', 'products', 'locations', 'inventory', 'mutations', 'customers', 'orderlines',
+                     'lines_per_order'):
+            parser.add_argument('--%s' % name.replace('_', '-'), type=int, default=datagen.DEFAULTS[name])
+
+    def handle(self, *args, **options):
+        schema_names = options['schemas'] or datagen.get_schema_names()
+        if not schema_names:
+            raise CommandError('no tenant schemas to fill')
+
+        generator_options = {name: options[name] for name in datagen.DEFAULTS}
+
+        if options['copy'] and connection.vendor != 'postgresql':
+            self.stderr.write('--copy needs PostgreSQL, using bulk_create')
+
+        for schema_name, counts in datagen.generate(schema_names, generator_options, options['processes']):
+            self.stdout.write(self.style.SUCCESS('%s: %s' % (
+                schema_name, ', '.join('%d %s' % (count, name) for name, count in sorted(counts.items()))
+            )))
@@ -0,0 +1,14 @@
+from django.utils import timezone
+
+from apps.purchase import sync
+from apps.purchase.management.base import TenantCommand
+from apps.purchase.models import SyncTombstone
+
+
+class Command(TenantCommand):
+    help = 'Delete sync tombstones older than PURCHASE_SYNC_TOMBSTONE_DAYS, in every tenant schema'
+
+    def handle_schema(self, **options):
+        count, _ = SyncTombstone.objects.filter(deleted__lt=timezone.now() - sync.get_retention()).delete()
+
+        return 'deleted %d tombstones' % count
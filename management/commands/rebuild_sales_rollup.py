@@ -0,0 +1,15 @@
+from apps.purchase.management.base import TenantCommand
+from apps.purchase.models import SalesRollup
+
+
+class Command(TenantCommand):
+    help = 'Rebuild the sales rollup table from the sales orderlines, in every tenant schema'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle_schema(self, **options):
+        count = SalesRollup.objects.rebuild(batch_size=options['batch_size'])
+
+        return 'rebuilt sales rollup, %d rows' % count
@@ -0,0 +1,15 @@
+from apps.purchase.management.base import TenantCommand
+from apps.purchase.models import StockInventorySnapshot
+
+
+class Command(TenantCommand):
+    help = 'Store a snapshot of the current stock location inventory, in every tenant schema'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle_schema(self, **options):
+        snapshot = StockInventorySnapshot.objects.take(batch_size=options['batch_size'])
+
+        return 'snapshot %s taken, %d lines' % (snapshot.taken, snapshot.lines.count())
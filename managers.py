@@ -1,4 +1,9 @@
-from django.db.models import Manager
+from itertools import islice
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Manager, Max, Sum
+from django.utils import timezone
 
 
 class ProductManager(Manager):
@@ -14,12 +19,261 @@ class StockLocationManager(Manager):
 
 
 class StockLocationMutationManager(Manager):
-    pass
+    def create_bulk(self, mutations, batch_size=500):
+        """
+        insert mutations with bulk_create and apply their netted inventory deltas, in one transaction
+        """
+        from . import report_cache
+
+        inventory_model = self.model._meta.apps.get_model(self.model._meta.app_label, 'StockLocationInventory')
+
+        deltas = {}
+        for mutation in mutations:
+            for key, amount in mutation.get_inventory_deltas().items():
+                deltas[key] = deltas.get(key, 0) + amount
+
+        with transaction.atomic():
+            mutations = self.bulk_create(mutations, batch_size=batch_size)
+            inventory_model.objects.adjust(deltas)
+
+        # bulk_create sends no post_save signals
+        report_cache.invalidate()
+
+        return mutations
 
 
 class StockLocationInventoryManager(Manager):
-    pass
+    def adjust(self, deltas):
+        """
+        add the amounts in deltas {(product_id, location_id): amount} to the inventory rows,
+        creating missing rows, without reading them first
+        """
+        # a fixed lock order keeps concurrent mutations from deadlocking
+        deltas = sorted(deltas.items(), key=lambda item: (item[0][0] or 0, item[0][1] or 0))
+        if not deltas:
+            return
+
+        if connection.vendor in ('postgresql', 'sqlite'):
+            self._upsert(deltas)
+        else:
+            for (product_id, location_id), amount in deltas:
+                self._increment(product_id, location_id, amount)
+
+    def _upsert(self, deltas):
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        table = qn(opts.db_table)
+        columns = [qn(opts.get_field(name).column) for name in ('product', 'location', 'amount', 'created', 'modified')]
+        product, location, amount, created, modified = columns
+        now = timezone.now()
+
+        sql = 'INSERT INTO %s (%s) VALUES %%s ' \
+              'ON CONFLICT (%s, %s) DO UPDATE SET %s = %s.%s + EXCLUDED.%s, %s = EXCLUDED.%s' % (
+            table, ', '.join(columns),
+            product, location,
+            amount, table, amount, amount,
+            modified, modified
+        )
+
+        batch_size = min(connection.ops.bulk_batch_size(columns, deltas), 1000)
+
+        with connection.cursor() as cursor:
+            for start in range(0, len(deltas), batch_size):
+                batch = deltas[start:start + batch_size]
+                params = []
+                for (product_id, location_id), delta in batch:
+                    params.extend([product_id, location_id, delta, now, now])
+
+                cursor.execute(sql % ', '.join(['(%s, %s, %s, %s, %s)'] * len(batch)), params)
+
+    def _increment(self, product_id, location_id, amount):
+        for attempt in range(2):
+            updated = self.filter(product_id=product_id, location_id=location_id).update(
+                amount=F('amount') + amount,
+                modified=timezone.now()
+            )
+
+            if updated:
+                return
+
+            try:
+                with transaction.atomic():
+                    self.create(product_id=product_id, location_id=location_id, amount=amount)
+                return
+            except IntegrityError:
+                # created by a concurrent mutation, update that row instead
+                if attempt:
+                    raise
 
 
 class StockAmountProductManager(Manager):
     pass
+
+
+class SalesRollupManager(Manager):
+    def is_enabled(self):
+        """
+        the table is only kept up to date while PURCHASE_SALES_ROLLUP is on, run rebuild() after turning it on
+        """
+        return getattr(settings, 'PURCHASE_SALES_ROLLUP', False)
+
+    def get_orderlines(self):
+        from apps.order.models import OrderLine
+
+        return OrderLine.objects.filter(order__order_type='sales')
+
+    def aggregate_orderlines(self, orderlines):
+        return orderlines.\
+            order_by().\
+            values('product_relation', 'order__customer_id', 'order__start_date', 'price_selling_currency').\
+            annotate(
+                rollup_order_name=Max('order__order_name'),
+                rollup_purchase_currency=Max('price_purchase_currency'),
+                rollup_amount=Sum('amount'),
+                rollup_price_purchase=Sum('price_purchase'),
+                rollup_price_selling=Sum('price_selling'),
+            )
+
+    def build_rows(self, aggregated):
+        for row in aggregated:
+            yield self.model(
+                product_id=row['product_relation'],
+                customer_id=row['order__customer_id'],
+                order_name=row['rollup_order_name'],
+                day=row['order__start_date'],
+                currency=row['price_selling_currency'],
+                price_purchase_currency=row['rollup_purchase_currency'],
+                amount=row['rollup_amount'] or 0,
+                price_purchase=row['rollup_price_purchase'] or 0,
+                price_selling=row['rollup_price_selling'] or 0,
+            )
+
+    def refresh(self, keys):
+        """
+        recompute the rollup rows for the given (product_id, customer_id, day) keys
+        """
+        keys = set(key for key in keys if key and key[0] and key[2])
+        if not keys:
+            return
+
+        with transaction.atomic():
+            for product_id, customer_id, day in keys:
+                self.filter(product_id=product_id, customer_id=customer_id, day=day).delete()
+
+                orderlines = self.get_orderlines().filter(
+                    product_relation_id=product_id,
+                    order__customer_id=customer_id,
+                    order__start_date=day
+                )
+
+                self.bulk_create(self.build_rows(self.aggregate_orderlines(orderlines)))
+
+    def rebuild(self, batch_size=1000):
+        """
+        recompute the whole rollup table from the orderlines
+        """
+        with transaction.atomic():
+            self.all().delete()
+
+            rows = self.build_rows(self.aggregate_orderlines(self.get_orderlines()).iterator())
+            count = 0
+
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+
+                self.bulk_create(batch, batch_size=batch_size)
+                count += len(batch)
+
+        return count
+
+
+class StockInventorySnapshotManager(Manager):
+    def get_model(self, name):
+        return self.model._meta.apps.get_model(self.model._meta.app_label, name)
+
+    def take(self, batch_size=1000):
+        """
+        copy the current stock location inventory into a new snapshot
+
+        On PostgreSQL the mutation table is locked while the inventory is read, so the snapshot holds
+        exactly the mutations up to max_mutation_id.
+        """
+        line_model = self.get_model('StockInventorySnapshotLine')
+        mutation_model = self.get_model('StockMutation')
+        inventory = self.get_model('StockLocationInventory').objects.order_by().values_list(
+            'product_id', 'location_id', 'amount'
+        )
+
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    # mutations apply their inventory deltas in the same transaction, SHARE mode waits
+                    # for the open ones and holds off new ones until the snapshot is stored
+                    cursor.execute('LOCK TABLE %s IN SHARE MODE' % connection.ops.quote_name(
+                        mutation_model._meta.db_table))
+
+            snapshot = self.create(
+                # the clock mutations take `created` from
+                taken=timezone.now(),
+                max_mutation_id=mutation_model.objects.aggregate(Max('id'))['id__max'] or 0
+            )
+
+            lines = (
+                line_model(snapshot=snapshot, product_id=product_id, location_id=location_id, amount=amount)
+                for product_id, location_id, amount in inventory.iterator()
+            )
+
+            while True:
+                batch = list(islice(lines, batch_size))
+                if not batch:
+                    break
+
+                line_model.objects.bulk_create(batch, batch_size=batch_size)
+
+        return snapshot
+
+    def get_amounts_at(self, when, product_id=None, location_id=None):
+        """
+        the inventory at `when` as {(product_id, location_id): amount}: the latest snapshot taken
+        before it, plus the mutations after the last one in that snapshot, up to `when`
+        """
+        snapshot = self.filter(taken__lte=when).order_by('-taken').first()
+        amounts = {}
+
+        mutations = self.get_model('StockMutation').objects.order_by().filter(created__lte=when)
+
+        if snapshot:
+            lines = snapshot.lines.all()
+            if product_id:
+                lines = lines.filter(product_id=product_id)
+            if location_id:
+                lines = lines.filter(location_id=location_id)
+
+            for line_product_id, line_location_id, amount in lines.values_list(
+                    'product_id', 'location_id', 'amount').iterator():
+                amounts[(line_product_id, line_location_id)] = amount
+
+            if snapshot.max_mutation_id is not None:
+                mutations = mutations.filter(id__gt=snapshot.max_mutation_id)
+            else:
+                mutations = mutations.filter(created__gt=snapshot.taken)
+
+        if product_id:
+            mutations = mutations.filter(product_id=product_id)
+
+        for location_field, types, sign in (
+                ('toLocation', ('purchase', 'move'), 1),
+                ('fromLocation', ('sales', 'move'), -1)):
+            rows = mutations.filter(mutationType__in=types)
+            if location_id:
+                rows = rows.filter(**{location_field: location_id})
+
+            rows = rows.values_list('product', location_field).annotate(total=Sum('amount'))
+
+            for row_product_id, row_location_id, total in rows:
+                key = (row_product_id, row_location_id)
+                amounts[key] = amounts.get(key, 0) + sign * total
+
+        return amounts
@@ -0,0 +1,209 @@
+import threading
+import time
+from functools import partial, wraps
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+
+from rest_framework import permissions
+
+from apps.core.rest import count_queries
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+ROWS_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+LABELS = ('viewset', 'action', 'tenant')
+
+
+class Histogram(object):
+    """
+    cumulative buckets, sum and count per label values, like a prometheus histogram
+    """
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            sample = self.samples.get(labels)
+            if sample is None:
+                sample = self.samples[labels] = [[0] * len(self.buckets), 0.0, 0]
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample[0][i] += 1
+            sample[1] += value
+            sample[2] += 1
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+    def render(self, tenant=None):
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s histogram' % self.name,
+        ]
+
+        with self.lock:
+            samples = sorted(
+                (labels, [list(sample[0]), sample[1], sample[2]]) for labels, sample in self.samples.items()
+            )
+
+        for labels, (buckets, total, count) in samples:
+            if tenant is not None and labels[LABELS.index('tenant')] != tenant:
+                continue
+
+            label_text = ','.join('%s="%s"' % (name, _escape(value)) for name, value in zip(LABELS, labels))
+            for bound, bucket_count in zip(self.buckets, buckets):
+                lines.append('%s_bucket{%s,le="%s"} %d' % (self.name, label_text, _format(bound), bucket_count))
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (self.name, label_text, count))
+            lines.append('%s_sum{%s} %s' % (self.name, label_text, _format(total)))
+            lines.append('%s_count{%s} %d' % (self.name, label_text, count))
+
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return ('%s' % value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else '%s' % value
+
+
+REQUEST_SECONDS = Histogram(
+    'purchase_request_seconds', 'Time from dispatch until the response is rendered.', LATENCY_BUCKETS)
+DB_SECONDS = Histogram(
+    'purchase_db_seconds', 'Time spent in database queries per request.', LATENCY_BUCKETS)
+SERIALIZER_SECONDS = Histogram(
+    'purchase_serializer_seconds', 'Time spent evaluating the serializer data per request.', LATENCY_BUCKETS)
+RENDER_SECONDS = Histogram(
+    'purchase_render_seconds', 'Time from the end of the view until the response is rendered.', LATENCY_BUCKETS)
+RESPONSE_BYTES = Histogram(
+    'purchase_response_bytes', 'Size of the rendered response body.', BYTES_BUCKETS)
+RESPONSE_ROWS = Histogram(
+    'purchase_response_rows', 'Rows in the response, 1 for a single object.', ROWS_BUCKETS)
+
+HISTOGRAMS = (REQUEST_SECONDS, DB_SECONDS, SERIALIZER_SECONDS, RENDER_SECONDS, RESPONSE_BYTES, RESPONSE_ROWS)
+
+
+def is_enabled():
+    return getattr(settings, 'PURCHASE_METRICS', True)
+
+
+def clear():
+    for histogram in HISTOGRAMS:
+        histogram.clear()
+
+
+def render(tenant=None):
+    """
+    the histograms in the prometheus text format, only the samples of tenant when given
+    """
+    return '\n'.join(histogram.render(tenant) for histogram in HISTOGRAMS) + '\n'
+
+
+def count_rows(data):
+    if isinstance(data, list):
+        return len(data)
+
+    if isinstance(data, dict):
+        for key in ('results', 'result'):
+            if isinstance(data.get(key), list):
+                return len(data[key])
+
+        return 1
+
+    return 0
+
+
+class MetricsMixin(object):
+    """
+    observe the metrics histograms for every request of a viewset, once the response is rendered
+    """
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+
+        if getattr(self, '_metrics', None) is not None:
+            # .data of a serializer, and of a ListSerializer, calls its own to_representation once
+            to_representation = serializer.to_representation
+
+            @wraps(to_representation)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return to_representation(*args, **kwargs)
+                finally:
+                    self._metrics['serializer'] += time.perf_counter() - start
+
+            serializer.to_representation = timed
+
+        return serializer
+
+    def dispatch(self, request, *args, **kwargs):
+        if not is_enabled():
+            return super().dispatch(request, *args, **kwargs)
+
+        start = time.perf_counter()
+        self._metrics = {'serializer': 0.0}
+
+        if hasattr(self, 'record_queries'):
+            # BaseMy24ViewSet counts the queries already
+            response = super().dispatch(request, *args, **kwargs)
+            db = getattr(self, 'query_time', 0.0)
+        else:
+            with count_queries() as queries:
+                response = super().dispatch(request, *args, **kwargs)
+            db = queries.duration
+
+        metrics = dict(self._metrics, start=start, db=db, dispatched=time.perf_counter())
+        labels = (self.__class__.__name__, getattr(self, 'action', None) or request.method.lower(),
+                  getattr(connection, 'schema_name', ''))
+
+        if hasattr(response, 'add_post_render_callback') and not response.is_rendered:
+            response.add_post_render_callback(partial(self.observe_metrics, labels, metrics))
+        else:
+            self.observe_metrics(labels, metrics, response)
+
+        return response
+
+    def observe_metrics(self, labels, metrics, response):
+        now = time.perf_counter()
+
+        REQUEST_SECONDS.observe(labels, now - metrics['start'])
+        DB_SECONDS.observe(labels, metrics['db'])
+        SERIALIZER_SECONDS.observe(labels, metrics['serializer'])
+        RENDER_SECONDS.observe(labels, now - metrics['dispatched'])
+        RESPONSE_ROWS.observe(labels, count_rows(getattr(response, 'data', None)))
+
+        if not response.streaming:
+            RESPONSE_BYTES.observe(labels, len(response.content))
+
+
+class MetricsPermission(permissions.BasePermission):
+    """
+    staff users, or a scraper sending `Authorization: Bearer <PURCHASE_METRICS_TOKEN>`
+    """
+    def has_permission(self, request, view):
+        return is_scraper(request) or bool(request.user and request.user.is_staff)
+
+
+def is_scraper(request):
+    token = getattr(settings, 'PURCHASE_METRICS_TOKEN', None)
+
+    return bool(token) and request.META.get('HTTP_AUTHORIZATION') == 'Bearer %s' % token
+
+
+def metrics_response(request):
+    """
+    scrapers see every tenant of this process, staff users only their own
+    """
+    tenant = None if is_scraper(request) else getattr(connection, 'schema_name', '')
+
+    return HttpResponse(render(tenant), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,4 +1,7 @@
-from django.db import models, connection
+import os
+
+from django.db import models, connection, transaction
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 from djmoney.models.fields import MoneyField
@@ -14,6 +17,11 @@ def _image_upload_location(instance, filename):
     return 'purchase-images/%s/%s' % (connection.tenant.member.companycode, filename)
 
 
+def _image_derivative_upload_location(instance, filename):
+    # next to the original, background workers don't know the tenant's company code
+    return '%s/thumbnails/%s' % (os.path.dirname(instance.source), filename)
+
+
 class Product(TimeStampedModel, My24ModelFieldsMixin, models.Model):
     identifier = models.CharField(_('Identifier'), max_length=255, null=True, blank=True)
     name = models.CharField(_('Name'), max_length=255, null=True, blank=True)
@@ -38,6 +46,7 @@ class Product(TimeStampedModel, My24ModelFieldsMixin, models.Model):
 
     class Meta:
         ordering = ['name']
+        # the trigram index on the search fields is created by search.CreateTrigramIndexes in a migration
 
     def show_name(self):
         if self.name and self.name_short:
@@ -56,6 +65,23 @@ class Product(TimeStampedModel, My24ModelFieldsMixin, models.Model):
         return self.name
 
 
+class ProductImageDerivative(models.Model):
+    """
+    A resized copy of Product.image, built in the background by thumbnails.build.
+    """
+    product = models.ForeignKey(Product, related_name='image_derivatives', on_delete=models.CASCADE)
+    source = models.CharField(_('Source'), max_length=100)
+    size = models.PositiveIntegerField(_('Size'))
+    format = models.CharField(_('Format'), max_length=10)
+    image = models.ImageField(_('Image'), max_length=255, upload_to=_image_derivative_upload_location)
+
+    class Meta:
+        unique_together = ('product', 'size', 'format')
+
+    def __str__(self):
+        return '%s %s %s' % (self.product_id, self.size, self.format)
+
+
 class Supplier(TimeStampedModel, LatLonModelMixin, My24ModelFieldsMixin):
     identifier = models.CharField(_('customer ID'), max_length=100, blank=True, null=True)
     name = models.CharField(_('(Company) name'), max_length=255, null=True, blank=True)
@@ -80,6 +106,7 @@ class Supplier(TimeStampedModel, LatLonModelMixin, My24ModelFieldsMixin):
     class Meta:
         ordering = ['name']
         unique_together = ('identifier', 'name', 'address', 'city', 'postal', 'country_code')
+        # the trigram index on the search fields is created by search.CreateTrigramIndexes in a migration
 
     def save(self, **kwargs):
         if not self.lon or not self.lat:
@@ -126,6 +153,7 @@ class StockLocationInventory(TimeStampedModel, My24ModelFieldsMixin, models.Mode
 
     class Meta:
         ordering = ['location__name']
+        unique_together = ('product', 'location')
 
     def __str__(self):
         return '%s %s %s' % (self.product, self.location, self.amount)
@@ -149,46 +177,110 @@ class StockMutation(TimeStampedModel, My24ModelFieldsMixin, models.Model):
     objects = managers.StockLocationMutationManager()
 
     def save(self, *args, **kwargs):
-        super().save(**kwargs)
+        with transaction.atomic():
+            super().save(**kwargs)
 
-        if self.mutationType == 'sales':
-            self.remove_from_stocklocation(self.product, self.fromLocation, self.amount)
+            StockLocationInventory.objects.adjust(self.get_inventory_deltas())
 
-        if self.mutationType == 'purchase':
-            self.add_to_stocklocation(self.product, self.toLocation, self.amount)
+    def get_inventory_deltas(self):
+        """
+        the inventory changes of this mutation, {(product_id, location_id): amount}
+        """
+        deltas = {}
 
-        if self.mutationType == 'move':
-            self.add_to_stocklocation(self.product, self.toLocation, self.amount)
-            self.remove_from_stocklocation(self.product, self.fromLocation, self.amount)
+        if self.mutationType in ('purchase', 'move'):
+            key = (self.product_id, self.toLocation_id)
+            deltas[key] = deltas.get(key, 0) + self.amount
+
+        if self.mutationType in ('sales', 'move'):
+            key = (self.product_id, self.fromLocation_id)
+            deltas[key] = deltas.get(key, 0) - self.amount
+
+        return deltas
 
     def add_to_stocklocation(self, product, location, amount):
-        try:
-            stocklocation_inventory = StockLocationInventory.objects.get(location=location, product=product)
-            stocklocation_inventory.amount += amount
-            stocklocation_inventory.save()
-        except StockLocationInventory.DoesNotExist:
-            stocklocation_inventory = StockLocationInventory(
-                location=location,
-                product=product,
-                amount=amount
-            )
-            stocklocation_inventory.save()
+        StockLocationInventory.objects.adjust({(product.pk, location.pk): amount})
 
     def remove_from_stocklocation(self, product, location, amount):
-        try:
-            stocklocation_inventory = StockLocationInventory.objects.get(location=location, product=product)
-            stocklocation_inventory.amount -= amount
-            stocklocation_inventory.save()
-        except StockLocationInventory.DoesNotExist:
-            stocklocation_inventory = StockLocationInventory(
-                location=location,
-                product=product,
-                amount=amount * -1
-            )
-            stocklocation_inventory.save()
+        StockLocationInventory.objects.adjust({(product.pk, location.pk): amount * -1})
 
     class Meta:
         ordering = ['-created']
 
     def __str__(self):
         return '%s %s' % (self.product, self.amount)
+
+
+class StockInventorySnapshot(TimeStampedModel, models.Model):
+    """
+    The stock location inventory at one moment, taken with `take_inventory_snapshot`.
+    """
+    taken = models.DateTimeField(_('Taken'), db_index=True)
+    # the last stock mutation in the snapshot, the ones after it are replayed on top
+    max_mutation_id = models.IntegerField(_('Last mutation'), null=True, blank=True)
+
+    objects = managers.StockInventorySnapshotManager()
+
+    class Meta:
+        ordering = ['-taken']
+
+    def __str__(self):
+        return '%s' % self.taken
+
+
+class StockInventorySnapshotLine(models.Model):
+    snapshot = models.ForeignKey(StockInventorySnapshot, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    location = models.ForeignKey(StockLocation, on_delete=models.CASCADE)
+    amount = models.IntegerField(_('Amount'))
+
+    def __str__(self):
+        return '%s %s %s' % (self.product_id, self.location_id, self.amount)
+
+
+class SyncTombstone(models.Model):
+    """
+    Deleted rows, so device clients can drop them on their next `changes` sync.
+    """
+    model = models.CharField(_('Model'), max_length=100)
+    object_id = models.IntegerField(_('Object ID'))
+    deleted = models.DateTimeField(_('Deleted'), default=timezone.now)
+
+    class Meta:
+        index_together = ('model', 'deleted')
+
+    def __str__(self):
+        return '%s %s' % (self.model, self.object_id)
+
+
+class SalesRollup(models.Model):
+    """
+    Sales orderlines summed per product, customer, day and currency.
+    Kept up to date from the orderline signals, rebuild with `rebuild_sales_rollup`.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sales_rollups')
+    customer_id = models.CharField(_('Customer ID'), max_length=100, null=True, blank=True)
+    order_name = models.CharField(_('Order name'), max_length=255, null=True, blank=True)
+    day = models.DateField(_('Day'))
+    currency = models.CharField(_('Currency'), max_length=3)
+    price_purchase_currency = models.CharField(_('Purchase currency'), max_length=3)
+    amount = models.IntegerField(_('Amount'), default=0)
+    price_purchase = models.DecimalField(_('Purchase price'), max_digits=14, decimal_places=2, default=0)
+    price_selling = models.DecimalField(_('Selling price'), max_digits=14, decimal_places=2, default=0)
+
+    objects = managers.SalesRollupManager()
+
+    class Meta:
+        unique_together = ('product', 'customer_id', 'day', 'currency')
+        index_together = ('day', 'product')
+        constraints = [
+            # NULLs are distinct in unique_together, one row without a customer per product, day and currency
+            models.UniqueConstraint(
+                fields=['product', 'day', 'currency'],
+                condition=models.Q(customer_id__isnull=True),
+                name='purchase_salesrollup_unique_no_customer',
+            ),
+        ]
+
+    def __str__(self):
+        return '%s %s %s %s' % (self.product_id, self.customer_id, self.day, self.amount)
@@ -0,0 +1,87 @@
+import datetime
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+
+
+def get_cache():
+    return caches[getattr(settings, 'PURCHASE_REPORT_CACHE', 'default')]
+
+
+def _version_key(schema_name):
+    return 'purchase-report-version:%s' % schema_name
+
+
+def get_version(schema_name=None):
+    schema_name = schema_name or connection.schema_name
+    cache = get_cache()
+    version = cache.get(_version_key(schema_name))
+
+    if version is None:
+        # start from the clock so an evicted counter never reuses an old version
+        version = int(time.time() * 1000)
+        cache.add(_version_key(schema_name), version, None)
+        version = cache.get(_version_key(schema_name), version)
+
+    return version
+
+
+def bump_version(schema_name=None):
+    schema_name = schema_name or connection.schema_name
+    cache = get_cache()
+
+    try:
+        cache.incr(_version_key(schema_name))
+    except ValueError:
+        cache.set(_version_key(schema_name), int(time.time() * 1000), None)
+
+
+def invalidate():
+    """
+    bump now so the changed data is seen right away, and again after commit so a report
+    computed by another request while the transaction was open is not kept
+    """
+    schema_name = connection.schema_name
+    bump_version(schema_name)
+    transaction.on_commit(lambda: bump_version(schema_name))
+
+
+def get_timeout(year):
+    """
+    past years don't change anymore, keep those until the version is bumped
+    """
+    try:
+        if int(year) < datetime.date.today().year:
+            return None
+    except (TypeError, ValueError):
+        pass
+
+    return getattr(settings, 'PURCHASE_REPORT_CACHE_TIMEOUT', 300)
+
+
+def get_key(report, year, query, variant=None):
+    schema_name = connection.schema_name
+    query_hash = hashlib.md5(('%s' % (query or '')).encode('utf-8')).hexdigest()
+    key = 'purchase-report:%s:%s:%s:%s:%s' % (schema_name, get_version(schema_name), report, year, query_hash)
+
+    return '%s:%s' % (key, variant) if variant else key
+
+
+def get_or_compute(report, year, query, compute, variant=None):
+    """
+    the cached report for the current tenant, computed with compute() on a miss
+
+    variant tells apart renderings of the same rows, like the image size asked for
+    """
+    cache = get_cache()
+    key = get_key(report, year, query, variant)
+    result = cache.get(key)
+
+    if result is None:
+        result = compute()
+        cache.set(key, result, get_timeout(year))
+
+    return result
@@ -1,9 +1,25 @@
+import cProfile
 import datetime
+import hashlib
+import json
 import logging
 import magic
 import math
-
+import os
+import pstats
+import tempfile
+import time
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connection, connections
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.http import http_date, parse_http_date_safe
 
 from django_filters import rest_framework as rest_framework_filters
 from drf_extra_fields.fields import Base64FileField
@@ -12,6 +28,7 @@ from rest_framework.generics import ListAPIView
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from rest_framework.settings import ISO_8601, api_settings
 from rest_framework.views import exception_handler
 from rest_auth.serializers import PasswordResetSerializer
 
@@ -89,27 +106,71 @@ def jwt_response_payload_handler(token, user=None, request=None):
 
 
 class TransformDatesMixin(object):
+    date_format_context_key = '_transform_dates_format'
+
     def to_representation(self, instance):
         ret = super(TransformDatesMixin, self).to_representation(instance)
         if 'created' in ret:
-            ret['created'] = self.transform_date(ret['created'])
+            ret['created'] = self.transform_field_date(instance, 'created', ret['created'])
 
         if 'modified' in ret:
-            ret['modified'] = self.transform_date(ret['modified'])
+            ret['modified'] = self.transform_field_date(instance, 'modified', ret['modified'])
 
         if 'last_login' in ret and ret['last_login']:
-            ret['last_login'] = self.transform_date(ret['last_login'])
+            ret['last_login'] = self.transform_field_date(instance, 'last_login', ret['last_login'])
 
         if 'date_joined' in ret and ret['date_joined']:
-            ret['date_joined'] = self.transform_date(ret['date_joined'])
+            ret['date_joined'] = self.transform_field_date(instance, 'date_joined', ret['date_joined'])
 
         return ret
 
+    def transform_field_date(self, instance, name, value):
+        """
+        transform_date(value) without parsing the ISO string back when the instance has the datetime
+        """
+        field = self.fields.get(name)
+        if not value or not isinstance(field, serializers.DateTimeField) or field.source != name:
+            return self.transform_date(value)
+
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        d = getattr(instance, name, None)
+        if not isinstance(output_format, str) or output_format.lower() != ISO_8601 or \
+                not isinstance(d, datetime.datetime):
+            return self.transform_date(value)
+
+        if settings.USE_TZ or timezone.is_aware(d):
+            # the ISO string carries an offset, which the parse patterns never matched
+            return value
+
+        return d.strftime(self.get_date_format())
+
+    def get_date_format(self):
+        """
+        the member's date format, looked up once per request and kept in the (shared) context
+        """
+        fmt = self.context.get(self.date_format_context_key)
+
+        if fmt is None:
+            request = self.context.get('request', None)
+            if request and 'member' in request.session:
+                fmt = request.session['member'].get_setting('date_format')
+            else:
+                fmt = '%Y/%m/%d'
+
+            fmt = '%s %%H:%%M' % fmt
+            self.context[self.date_format_context_key] = fmt
+
+        return fmt
+
     def transform_date(self, value):
         if not value:
             return '-'
 
         if isinstance(value, str):
+            if value.endswith('Z') or '+' in value[19:] or '-' in value[19:]:
+                # an aware ISO string, the patterns below don't match its offset
+                return value
+
             try:
                 d = datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f")
             except ValueError:
@@ -120,24 +181,229 @@ class TransformDatesMixin(object):
         else:
             d = value
 
+        return d.strftime(self.get_date_format())
+
+
+def _split_fieldset(value):
+    if not value:
+        return []
+
+    return [entry.strip() for entry in value.split(',') if entry.strip()]
+
+
+class SparseFieldsetMixin(object):
+    """
+    Select fields with ?fields=id,name,product.name or drop them with ?omit=image,product.image.
+
+    Dotted names select the fields of nested serializers. Only applies to GET requests.
+    Meta.sparse_field_sources lists the model paths a SerializerMethodField reads, so
+    get_sparse_queryset() can defer everything else.
+    """
+    sparse_fields_query_param = 'fields'
+    sparse_omit_query_param = 'omit'
+
+    def get_fieldset_path(self):
+        path = []
+        node = self
+
+        while node.parent is not None:
+            if node.field_name:
+                path.insert(0, node.field_name)
+            node = node.parent
+
+        return '.'.join(path)
+
+    def get_sparse_fieldset(self):
+        """
+        the (include, omit) field names for this serializer, include is None when all are included
+        """
         request = self.context.get('request', None)
-        if request and 'member' in request.session:
-            fmt = request.session['member'].get_setting('date_format')
-        else:
-            fmt = '%Y/%m/%d'
-        s = '%s %%H:%%M' % fmt
-        return d.strftime(s)
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return None, set()
+
+        prefix = self.get_fieldset_path()
+        include = None
+        omit = set()
+
+        entries = _split_fieldset(request.query_params.get(self.sparse_fields_query_param))
+        if entries:
+            names = set()
+            whole = False
+
+            for entry in entries:
+                if prefix:
+                    if entry == prefix:
+                        whole = True
+                        continue
+
+                    if not entry.startswith(prefix + '.'):
+                        continue
+
+                    entry = entry[len(prefix) + 1:]
+
+                names.add(entry.split('.')[0])
+
+            if names and not whole:
+                include = names
+
+        for entry in _split_fieldset(request.query_params.get(self.sparse_omit_query_param)):
+            if prefix:
+                if not entry.startswith(prefix + '.'):
+                    continue
+
+                entry = entry[len(prefix) + 1:]
+
+            if '.' not in entry:
+                omit.add(entry)
+
+        return include, omit
+
+    def get_fields(self):
+        fields = super(SparseFieldsetMixin, self).get_fields()
+        include, omit = self.get_sparse_fieldset()
+
+        for name in list(fields.keys()):
+            if (include is not None and name not in include) or name in omit:
+                del fields[name]
+
+        return fields
+
+
+class _UnknownSource(Exception):
+    pass
+
+
+def _get_model_paths(serializer, model, prefix=''):
+    """
+    the model field paths the serializer reads, raises _UnknownSource when that can't be told
+    """
+    paths = set()
+    relations = set()
+    method_sources = getattr(getattr(serializer, 'Meta', None), 'sparse_field_sources', {})
+
+    for name, field in serializer.fields.items():
+        if name in method_sources:
+            for path in method_sources[name]:
+                paths.add(prefix + path)
+
+                if '__' in path:
+                    relations.add(prefix + path.rsplit('__', 1)[0])
+
+            continue
+
+        if field.source == '*' or len(field.source_attrs) != 1:
+            raise _UnknownSource(name)
+
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            raise _UnknownSource(name)
+
+        if model_field.many_to_many or model_field.one_to_many or not model_field.concrete:
+            raise _UnknownSource(name)
+
+        paths.add(prefix + model_field.name)
+
+        currency_field = '%s_currency' % model_field.name
+        if any(f.name == currency_field for f in model._meta.concrete_fields):
+            paths.add(prefix + currency_field)
+
+        if isinstance(field, serializers.BaseSerializer):
+            if not model_field.many_to_one and not model_field.one_to_one:
+                raise _UnknownSource(name)
+
+            relations.add(prefix + model_field.name)
+            nested_paths, nested_relations = _get_model_paths(
+                field, model_field.related_model, '%s%s__' % (prefix, model_field.name)
+            )
+            paths.update(nested_paths)
+            relations.update(nested_relations)
+
+    return paths, relations
+
+
+def get_sparse_queryset(queryset, serializer, extra_paths=()):
+    """
+    load only the columns the (sparse) serializer reads, and only join the relations it uses
+
+    extra_paths are loaded as well, those through a relation only when that relation is joined anyway.
+    """
+    try:
+        paths, relations = _get_model_paths(serializer, queryset.model)
+    except _UnknownSource:
+        return queryset
+
+    paths.update(relations)
+    paths.update(path for path in extra_paths if '__' not in path or path.rsplit('__', 1)[0] in relations)
+    queryset = queryset.select_related(None)
+
+    if relations:
+        queryset = queryset.select_related(*sorted(relations))
+
+    return queryset.only(*sorted(paths))
+
+
+def estimate_count(queryset):
+    """
+    the planner's row estimate for queryset, None when it can't be had
+    """
+    if not hasattr(queryset, 'query'):
+        return None
+
+    conn = connections[queryset.db]
+    if conn.vendor != 'postgresql':
+        return None
+
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+
+    with conn.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) %s' % sql, params)
+        plan = cursor.fetchone()[0]
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class My24Paginator(DjangoPaginator):
+    """
+    Paginator that takes the planner estimate as count when that is above `estimate_threshold`.
+    """
+    def __init__(self, object_list, per_page, estimate_threshold=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.estimate_threshold = estimate_threshold
+        self.count_exact = True
+
+    @cached_property
+    def count(self):
+        if self.estimate_threshold is not None:
+            estimate = estimate_count(self.object_list)
+
+            if estimate is not None and estimate > self.estimate_threshold:
+                self.count_exact = False
+                return estimate
+
+        return super().count
 
 
 class My24Pagination(pagination.PageNumberPagination):
     page_size = 20
     page_size_query_param = 'page_size'
     max_page_size = 1000
+    # estimate the count of lists that are bigger than this, views can override it
+    estimate_count_threshold = None
     _page_size = None
 
     def paginate_queryset(self, queryset, request, view=None):
         self._page_size = self.get_page_size(request)
 
+        threshold = getattr(view, 'estimate_count_threshold', self.estimate_count_threshold)
+        self.django_paginator_class = partial(My24Paginator, estimate_threshold=threshold)
+
         return super().paginate_queryset(queryset, request, view=view)
 
     def get_page_size(self, request):
@@ -158,12 +424,225 @@ class My24Pagination(pagination.PageNumberPagination):
             'next': self.get_next_link(),
             'previous': self.get_previous_link(),
             'count': self.page.paginator.count,
+            'count_exact': self.page.paginator.count_exact,
             'num_pages': math.ceil(self.page.paginator.count / self._page_size),
             'results': data,
         })
 
 
-class BaseListView(ListAPIView):
+class My24CursorPagination(pagination.CursorPagination):
+    """
+    Keyset pagination on the ordering of the view, without counting.
+
+    The envelope matches My24Pagination, `count` and `num_pages` are None.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', None) or \
+            queryset.query.order_by or \
+            queryset.model._meta.ordering
+
+        ordering = tuple(ordering)
+
+        if not ordering or not self.is_keyset_ordering(queryset.model, ordering):
+            return ('-pk',)
+
+        return ordering
+
+    def is_keyset_ordering(self, model, ordering):
+        """
+        the cursor holds the value of the first ordering field, it must be a plain, non null field
+        """
+        if not all(isinstance(field, str) and '__' not in field for field in ordering):
+            return False
+
+        name = ordering[0].lstrip('-')
+        if name == 'pk':
+            return True
+
+        try:
+            return not model._meta.get_field(name).null
+        except FieldDoesNotExist:
+            return False
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'count': None,
+            'num_pages': None,
+            'results': data,
+        })
+
+
+class QueryCounter(object):
+    """
+    connection.execute_wrapper that counts queries and the seconds spent in them
+    """
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+@contextmanager
+def count_queries(using='default'):
+    """
+    with count_queries() as queries: ... then queries.count and queries.duration
+    """
+    counter = QueryCounter()
+
+    with connections[using].execute_wrapper(counter):
+        yield counter
+
+
+# where the time of a profiled function goes, matched on its file name, the rest is counted as python
+PROFILE_CATEGORIES = (
+    ('db', ('/django/db/', 'psycopg2', 'sqlite3', '/tenant_schemas/postgresql_backend/')),
+    ('serializer', ('/rest_framework/serializers.py', '/rest_framework/fields.py', '/rest_framework/relations.py',
+                    '/djmoney/contrib/django_rest_framework/')),
+    ('renderer', ('/rest_framework/renderers.py', '/json/', '_json', '/drf_renderer_xlsx/', '/openpyxl/')),
+)
+
+
+def get_profile_category(func):
+    filename, line, name = func
+    text = '%s %s' % (filename.replace('\\', '/'), name)
+
+    for category, patterns in PROFILE_CATEGORIES:
+        if any(pattern in text for pattern in patterns):
+            return category
+
+    return 'python'
+
+
+def get_profile_dir():
+    return getattr(settings, 'PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'my24-profiles'))
+
+
+def prune_profiles(directory):
+    """
+    remove reports older than PROFILE_RETENTION_DAYS and all but the newest PROFILE_MAX_REPORTS
+    """
+    oldest = time.time() - getattr(settings, 'PROFILE_RETENTION_DAYS', 7) * 86400
+    keep = getattr(settings, 'PROFILE_MAX_REPORTS', 200)
+
+    paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.json')]
+    paths.sort(key=os.path.getmtime, reverse=True)
+
+    for i, path in enumerate(paths):
+        if i >= keep or os.path.getmtime(path) < oldest:
+            for remove in (path, '%s.prof' % path[:-len('.json')]):
+                try:
+                    os.remove(remove)
+                except FileNotFoundError:
+                    pass
+
+
+class ProfileMixin(object):
+    """
+    ?_profile=1 runs the request of a staff user under cProfile, the report is written to PROFILE_DIR
+    and named in the X-Profile-Report header, the time per category is sent as Server-Timing
+    """
+    profile_query_param = '_profile'
+    profile_top = 30
+
+    def use_profile(self, request):
+        return bool(request.query_params.get(self.profile_query_param)) and \
+            getattr(request.user, 'is_staff', False)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        # started after authentication, so only staff requests pay for it
+        if self.use_profile(request):
+            self._profile_queries = QueryCounter()
+            connection.execute_wrappers.append(self._profile_queries)
+            self._profiler = cProfile.Profile()
+            self._profile_start = time.perf_counter()
+            self._profiler.enable()
+
+    def dispatch(self, request, *args, **kwargs):
+        self._profiler = None
+
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+
+            if self._profiler is not None and hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        finally:
+            if self._profiler is not None:
+                self._profiler.disable()
+                connection.execute_wrappers.remove(self._profile_queries)
+
+        if self._profiler is None:
+            return response
+
+        self.write_profile(response, time.perf_counter() - self._profile_start)
+
+        return response
+
+    def get_profile_report(self, stats, total):
+        times = dict.fromkeys(('db', 'serializer', 'renderer', 'python'), 0.0)
+        for func, (primitive_calls, calls, own_time, cumulative_time, callers) in stats.stats.items():
+            times[get_profile_category(func)] += own_time
+
+        top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:self.profile_top]
+
+        return {
+            'created': timezone.now().isoformat(),
+            'path': self.request.get_full_path(),
+            'view': self.__class__.__name__,
+            'action': getattr(self, 'action', None),
+            'schema': getattr(connection, 'schema_name', None),
+            'user': self.request.user.pk,
+            'total': total,
+            'times': times,
+            'queries': self._profile_queries.count,
+            'query_time': self._profile_queries.duration,
+            'top': [{
+                'function': '%s:%d(%s)' % func,
+                'calls': calls,
+                'own_time': own_time,
+                'cumulative_time': cumulative_time,
+            } for func, (primitive_calls, calls, own_time, cumulative_time, callers) in top],
+        }
+
+    def write_profile(self, response, total):
+        stats = pstats.Stats(self._profiler)
+        report = self.get_profile_report(stats, total)
+
+        directory = get_profile_dir()
+        os.makedirs(directory, exist_ok=True)
+        name = '%s-%s-%s' % (
+            timezone.now().strftime('%Y%m%d%H%M%S%f'), self.__class__.__name__, report['action'] or 'view'
+        )
+
+        with open(os.path.join(directory, '%s.json' % name), 'w') as f:
+            json.dump(report, f, indent=2)
+        # for snakeviz and friends
+        stats.dump_stats(os.path.join(directory, '%s.prof' % name))
+
+        prune_profiles(directory)
+
+        response['X-Profile-Report'] = '%s.json' % name
+        response['Server-Timing'] = ', '.join(
+            '%s;dur=%.1f' % (category, seconds * 1000) for category, seconds in report['times'].items()
+        )
+
+
+class BaseListView(ProfileMixin, ListAPIView):
     permission_classes = (IsAdminUser,)
     pagination_class = My24Pagination
 
@@ -191,7 +670,7 @@ class RelatedSummaryField(serializers.ReadOnlyField):
         )
 
 
-class BaseMy24ViewSet(BaseViewSet):
+class BaseMy24ViewSet(ProfileMixin, BaseViewSet):
     """
     Viewset that supports all normal viewset functionality.
     """
@@ -199,6 +678,204 @@ class BaseMy24ViewSet(BaseViewSet):
     permission_classes = (IsAuthenticated, )
     pagination_class = My24Pagination
     filter_backends = (filters.SearchFilter, rest_framework_filters.DjangoFilterBackend,)
+    cursor_pagination_class = My24CursorPagination
+    # 'page' or 'cursor', clients can switch with ?pagination=
+    pagination_mode = 'page'
+    pagination_mode_query_param = 'pagination'
+
+    def get_pagination_mode(self):
+        request = getattr(self, 'request', None)
+        mode = request.query_params.get(self.pagination_mode_query_param) if request else None
+
+        if mode in ('page', 'cursor'):
+            return mode
+
+        return self.pagination_mode
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.pagination_class is None:
+                self._paginator = None
+            elif self.get_pagination_mode() == 'cursor':
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = self.pagination_class()
+
+        return self._paginator
+
+    def dispatch(self, request, *args, **kwargs):
+        with count_queries() as queries:
+            response = super().dispatch(request, *args, **kwargs)
+
+        self.record_queries(queries, response)
+
+        return response
+
+    def record_queries(self, queries, response):
+        """
+        log the queries of a request per viewset action, and send them in headers when debugging
+        """
+        self.query_count = queries.count
+        self.query_time = queries.duration
+
+        logger.debug('%s.%s: %d queries in %.1fms', self.__class__.__name__, getattr(self, 'action', None),
+                     queries.count, queries.duration * 1000)
+
+        if getattr(settings, 'QUERY_COUNT_HEADERS', settings.DEBUG):
+            response['X-Query-Count'] = '%d' % queries.count
+            response['X-Query-Time'] = '%.1f' % (queries.duration * 1000)
+
+    # actions whose queryset follows ?fields= / ?omit= of a SparseFieldsetMixin serializer
+    sparse_fieldset_actions = ('list', 'retrieve')
+
+    def use_sparse_queryset(self):
+        request = getattr(self, 'request', None)
+        if request is None or request.method not in ('GET', 'HEAD') or self.action not in self.sparse_fieldset_actions:
+            return False
+
+        serializer_class = self.get_serializer_class()
+        if not issubclass(serializer_class, SparseFieldsetMixin):
+            return False
+
+        return serializer_class.sparse_fields_query_param in request.query_params or \
+            serializer_class.sparse_omit_query_param in request.query_params
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        if self.use_sparse_queryset():
+            extra_paths = ()
+            if self.use_conditional_get():
+                extra_paths = ['modified'] + ['%s__modified' % relation for relation in self.conditional_get_related]
+
+            queryset = get_sparse_queryset(queryset, self.get_serializer(), extra_paths)
+
+        return queryset
+
+    # set to give list and retrieve responses an ETag and Last-Modified based on `modified`
+    conditional_get = False
+    # relations whose `modified` also shows up in the response, e.g. a nested product name
+    conditional_get_related = ()
+
+    def get_validators(self, objects, count=None):
+        """
+        (etag, last_modified) of the objects a response is built from, without queries: the pk and
+        `modified` of every object and of its loaded conditional_get_related, plus the count of a list
+        """
+        stamps = []
+        last_modified = None
+
+        for obj in objects:
+            values = [obj.modified]
+
+            for relation in self.conditional_get_related:
+                # relations a sparse queryset didn't join aren't in the response either
+                if not obj._meta.get_field(relation).is_cached(obj):
+                    continue
+
+                related = getattr(obj, relation)
+                values.append(
+                    related.modified if related is not None and 'modified' not in related.get_deferred_fields()
+                    else None
+                )
+
+            for value in values:
+                if value is not None and (last_modified is None or value > last_modified):
+                    last_modified = value
+
+            stamps.append('%s=%s' % (obj.pk, ','.join(value.isoformat() if value else '' for value in values)))
+
+        return self.make_etag(stamps, count), last_modified
+
+    def make_etag(self, stamps, count):
+        request = self.request
+        accepted = getattr(request, 'accepted_media_type', '')
+        value = '%s:%s:%s:%s:%s:%s' % (
+            getattr(connection, 'schema_name', ''), request.get_full_path(), accepted,
+            count if count is not None else '', request.user.pk, ';'.join(stamps)
+        )
+
+        return '"%s"' % hashlib.md5(value.encode('utf-8')).hexdigest()
+
+    def use_conditional_get(self):
+        if not self.conditional_get or self.request.method not in ('GET', 'HEAD'):
+            return False
+
+        model = getattr(self, 'model', None) or self.queryset.model
+        try:
+            model._meta.get_field('modified')
+        except FieldDoesNotExist:
+            return False
+
+        return True
+
+    def is_not_modified(self, etag, last_modified):
+        if_none_match = self.request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            # If-None-Match uses the weak comparison, W/"x" matches "x"
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+            return etag in tags or if_none_match.strip() == '*'
+
+        if_modified_since = self.request.META.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since and last_modified:
+            since = parse_http_date_safe(if_modified_since)
+            return since is not None and int(last_modified.timestamp()) <= since
+
+        return False
+
+    def conditional_response(self, etag, last_modified, build_response):
+        if self.is_not_modified(etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = build_response()
+
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+
+        return response
+
+    def list(self, request, *args, **kwargs):
+        # cursor pages are cheap to build and have no count to put in the ETag
+        if not self.use_conditional_get() or self.get_pagination_mode() == 'cursor':
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+
+        # the validators come from the page the response is built from, with the count the paginator
+        # made (or estimated) anyway, only the serializing is saved when nothing changed
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            objects, count = page, self.paginator.page.paginator.count
+        else:
+            objects = list(queryset)
+            count = len(objects)
+
+        etag, last_modified = self.get_validators(objects, count)
+
+        def build_response():
+            serializer = self.get_serializer(objects, many=True)
+            if page is not None:
+                return self.get_paginated_response(serializer.data)
+
+            return Response(serializer.data)
+
+        return self.conditional_response(etag, last_modified, build_response)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.use_conditional_get():
+            return super().retrieve(request, *args, **kwargs)
+
+        instance = self.get_object()
+        etag, last_modified = self.get_validators([instance])
+
+        return self.conditional_response(
+            etag, last_modified,
+            lambda: Response(self.get_serializer(instance).data)
+        )
 
     def is_create(self):
         return self.request.method == 'POST' or (
@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.db import connection
+from django.db.migrations.operations.base import Operation
+from django.db.models import Q
+
+from tenant_schemas.utils import get_public_schema_name
+
+PRODUCT_SEARCH_FIELDS = ('identifier', 'name', 'name_short', 'search_name', 'unit', 'supplier', 'product_type')
+SUPPLIER_SEARCH_FIELDS = ('name', 'address', 'city', 'email')
+
+
+def get_limit(request, default=None, maximum=None):
+    """
+    the ?limit= of an autocomplete request, capped at PURCHASE_AUTOCOMPLETE_MAX_LIMIT
+    """
+    default = default or getattr(settings, 'PURCHASE_AUTOCOMPLETE_LIMIT', 50)
+    maximum = maximum or getattr(settings, 'PURCHASE_AUTOCOMPLETE_MAX_LIMIT', 200)
+
+    try:
+        limit = int(request.query_params.get('limit', default))
+    except (TypeError, ValueError):
+        limit = default
+
+    return max(1, min(limit, maximum))
+
+
+# (model name, index name, fields) of the gin_trgm_ops indexes that serve search()
+TRIGRAM_INDEXES = (
+    ('product', 'purchase_product_trgm', PRODUCT_SEARCH_FIELDS),
+    ('supplier', 'purchase_supplier_trgm', SUPPLIER_SEARCH_FIELDS),
+)
+
+
+class CreateTrigramIndexes(Operation):
+    """
+    migration operation: the pg_trgm extension and the TRIGRAM_INDEXES, only on PostgreSQL
+
+    The indexes are not in the model Meta, so `migrate` keeps working on other databases.
+    """
+    reversible = True
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+
+        qn = schema_editor.quote_name
+        # in the public schema, which is on the search path of every tenant
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm WITH SCHEMA %s' % qn(get_public_schema_name()))
+
+        for model_name, name, fields in TRIGRAM_INDEXES:
+            opts = to_state.apps.get_model(app_label, model_name)._meta
+            schema_editor.execute('CREATE INDEX IF NOT EXISTS %s ON %s USING gin (%s)' % (
+                qn(name), qn(opts.db_table),
+                ', '.join('%s gin_trgm_ops' % qn(opts.get_field(field).column) for field in fields)
+            ))
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+
+        for model_name, name, fields in TRIGRAM_INDEXES:
+            schema_editor.execute('DROP INDEX IF EXISTS %s' % schema_editor.quote_name(name))
+
+    def describe(self):
+        return 'Create the trigram search indexes on PostgreSQL'
+
+
+def ilike_filter(queryset, fields, query):
+    """
+    rows of queryset with query in one of fields, as `col ILIKE '%query%'`, PostgreSQL only
+
+    icontains compiles to `UPPER(col::text) LIKE UPPER(...)`, which a gin_trgm_ops index on col can't serve.
+    """
+    opts = queryset.model._meta
+    qn = connection.ops.quote_name
+    pattern = '%%%s%%' % connection.ops.prep_for_like_query(query)
+
+    where = ' OR '.join(
+        '%s.%s ILIKE %%s' % (qn(opts.db_table), qn(opts.get_field(field).column)) for field in fields
+    )
+
+    return queryset.extra(where=['(%s)' % where], params=[pattern] * len(fields))
+
+
+def use_trigram():
+    """
+    PostgreSQL, where CreateTrigramIndexes added the pg_trgm extension and the indexes
+    """
+    return connection.vendor == 'postgresql'
+
+
+def search(queryset, fields, query, limit):
+    """
+    rows of queryset with query in one of fields, best matches first
+
+    On PostgreSQL the fields are matched with ILIKE, which the gin_trgm_ops indexes serve, and the rows
+    are ranked by trigram similarity, elsewhere icontains is used and they come in the default ordering.
+    """
+    if not use_trigram():
+        filter_q = Q()
+        for field in fields:
+            filter_q |= Q(**{'%s__icontains' % field: query})
+
+        return queryset.filter(filter_q)[:limit]
+
+    from django.contrib.postgres.search import TrigramSimilarity
+    from django.db.models.functions import Greatest
+
+    similarities = [TrigramSimilarity(field, query) for field in fields]
+    rank = Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+
+    return ilike_filter(queryset, fields, query).annotate(search_rank=rank).order_by('-search_rank', 'pk')[:limit]
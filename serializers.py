@@ -1,12 +1,17 @@
 import datetime
 
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db.models import Sum
 from djmoney.contrib.django_rest_framework import MoneyField
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers, validators
+from rest_framework.settings import api_settings
 
 from apps.core import rest
 from apps.order.models import OrderLine
 from . import models
+from . import thumbnails
 
 
 class ProductTotalSerializer(serializers.Serializer):
@@ -21,7 +26,19 @@ class ProductTotalSerializer(serializers.Serializer):
     amount_selling_perc = serializers.FloatField()
 
 
-class ProductSerializer(rest.TransformDatesMixin, serializers.ModelSerializer):
+class UploadedImageField(Base64ImageField):
+    """
+    Base64ImageField that also takes a multipart upload, which is spooled to disk by the upload handlers
+    instead of being decoded in memory
+    """
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            return serializers.ImageField.to_internal_value(self, data)
+
+        return super().to_internal_value(data)
+
+
+class ProductSerializer(rest.SparseFieldsetMixin, rest.TransformDatesMixin, serializers.ModelSerializer):
     show_name = serializers.SerializerMethodField()
 
     price_purchase = MoneyField(max_digits=10, decimal_places=2)
@@ -32,7 +49,7 @@ class ProductSerializer(rest.TransformDatesMixin, serializers.ModelSerializer):
     price_selling_ex = MoneyField(max_digits=10, decimal_places=2)
     price_selling_alt_ex = MoneyField(max_digits=10, decimal_places=2)
 
-    image = Base64ImageField(required=False)
+    image = UploadedImageField(required=False)
 
     def get_show_name(self, obj):
         if hasattr(obj, 'show_name'):
@@ -40,15 +57,46 @@ class ProductSerializer(rest.TransformDatesMixin, serializers.ModelSerializer):
 
         return ''
 
+    def get_image_thumbnail(self, instance, size, format):
+        # the viewsets prefetch these, without them the original image is kept instead of a query per row
+        derivatives = getattr(instance, 'image_thumbnails', None)
+        if derivatives is None:
+            return None
+
+        for derivative in derivatives:
+            if derivative.source == instance.image.name:
+                return derivative.image.url
+
+        return None
+
+    def to_representation(self, instance):
+        """
+        ?image_size= replaces the image with the thumbnail of that size, once it is built
+        """
+        ret = super().to_representation(instance)
+        request = self.context.get('request')
+
+        if ret.get('image'):
+            size, format = thumbnails.get_request_options(request)
+            url = self.get_image_thumbnail(instance, size, format) if size else None
+
+            if url:
+                ret['image'] = request.build_absolute_uri(url)
+
+        return ret
+
     class Meta:
         model = models.Product
         fields = ('id', 'identifier', 'show_name', 'name', 'name_short', 'unit', 'supplier', 'product_type', 'modified',
                   'price_purchase', 'price_selling', 'price_selling_alt',
                   'price_purchase_ex', 'price_selling_ex', 'price_selling_alt_ex',
                   'image')
+        sparse_field_sources = {
+            'show_name': ('name', 'name_short'),
+        }
 
 
-class SupplierSerializer(rest.TransformDatesMixin, serializers.ModelSerializer):
+class SupplierSerializer(rest.SparseFieldsetMixin, rest.TransformDatesMixin, serializers.ModelSerializer):
     class Meta:
         model = models.Supplier
         validators = [
@@ -61,44 +109,48 @@ class SupplierSerializer(rest.TransformDatesMixin, serializers.ModelSerializer):
                   'email', 'contact', 'mobile', 'remarks', 'identifier', 'created', 'modified')
 
 
-class StockLocationSerializer(rest.TransformDatesMixin, serializers.ModelSerializer):
+class StockLocationSerializer(rest.SparseFieldsetMixin, rest.TransformDatesMixin, serializers.ModelSerializer):
     class Meta:
         model = models.StockLocation
         fields = ('id', 'identifier', 'name', 'modified')
 
 
-class StockLocationInventorySerializer(rest.TransformDatesMixin, serializers.ModelSerializer):
+class StockLocationInventorySerializer(rest.SparseFieldsetMixin, rest.TransformDatesMixin, serializers.ModelSerializer):
     class Meta:
         model = models.StockLocationInventory
         fields = ('id', 'product', 'location', 'amount', 'modified')
 
 
-class StockLocationInventoryFullSerializer(rest.TransformDatesMixin, serializers.ModelSerializer):
+class StockLocationInventoryFullSerializer(rest.SparseFieldsetMixin, rest.TransformDatesMixin,
+                                          serializers.ModelSerializer):
     location = StockLocationSerializer()
     product = ProductSerializer()
     sales_amount_today = serializers.SerializerMethodField()
 
     def get_sales_amount_today(self, obj):
-        amount = 0
-
-        orderlines = OrderLine.objects.filter(
-            location_relation=obj.location,
-            product_relation=obj.product,
+        # list_full computes these for the whole page in one query
+        amounts = self.context.get('sales_amount_today')
+        if amounts is not None:
+            return amounts.get((obj.location_id, obj.product_id), 0)
+
+        amount = OrderLine.objects.filter(
+            location_relation_id=obj.location_id,
+            product_relation_id=obj.product_id,
             order__start_date=datetime.date.today(),
             order__order_type='sales'
-        )
+        ).aggregate(Sum('amount'))['amount__sum']
 
-        for orderline in orderlines:
-            amount += orderline.amount
-
-        return amount
+        return amount or 0
 
     class Meta:
         model = models.StockLocationInventory
         fields = ('id', 'product', 'location', 'amount', 'sales_amount_today', 'modified')
+        sparse_field_sources = {
+            'sales_amount_today': ('location', 'product'),
+        }
 
 
-class StockMutationSerializer(rest.TransformDatesMixin, serializers.ModelSerializer):
+class StockMutationSerializer(rest.SparseFieldsetMixin, rest.TransformDatesMixin, serializers.ModelSerializer):
     summary = serializers.SerializerMethodField()
     product_name = serializers.SerializerMethodField()
 
@@ -119,3 +171,84 @@ class StockMutationSerializer(rest.TransformDatesMixin, serializers.ModelSeriali
         model = models.StockMutation
         fields = ('id', 'product', 'fromLocation', 'toLocation', 'amount',
                   'mutationType', 'modified', 'summary', 'product_name')
+        sparse_field_sources = {
+            'summary': ('mutationType', 'fromLocation__name', 'fromLocation__identifier',
+                        'toLocation__name', 'toLocation__identifier'),
+            'product_name': ('product__name', 'product__identifier'),
+        }
+
+
+class StockMutationBulkListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        maximum = getattr(settings, 'PURCHASE_STOCK_MUTATION_BULK_MAX', 1000)
+
+        # before validating every item
+        if isinstance(data, list) and len(data) > maximum:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: ['Send at most %d mutations at once.' % maximum]
+            })
+
+        return super().to_internal_value(data)
+
+    def validate(self, attrs):
+        """
+        check all referenced products and locations with one query per model
+        """
+        product_ids = set(item['product'] for item in attrs)
+        location_ids = set(
+            item[field] for item in attrs for field in ('fromLocation', 'toLocation') if item.get(field)
+        )
+
+        known_products = set(models.Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+        known_locations = set(models.StockLocation.objects.filter(id__in=location_ids).values_list('id', flat=True))
+
+        errors = []
+        for item in attrs:
+            item_errors = {}
+
+            if item['product'] not in known_products:
+                item_errors['product'] = ['Invalid pk "%s" - object does not exist.' % item['product']]
+
+            for field in ('fromLocation', 'toLocation'):
+                if item.get(field) and item[field] not in known_locations:
+                    item_errors[field] = ['Invalid pk "%s" - object does not exist.' % item[field]]
+
+            errors.append(item_errors)
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        return attrs
+
+    def create(self, validated_data):
+        mutations = [
+            models.StockMutation(
+                product_id=item['product'],
+                fromLocation_id=item.get('fromLocation'),
+                toLocation_id=item.get('toLocation'),
+                mutationType=item['mutationType'],
+                amount=item['amount'],
+            ) for item in validated_data
+        ]
+
+        return models.StockMutation.objects.create_bulk(mutations)
+
+
+class StockMutationBulkSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    fromLocation = serializers.IntegerField(required=False, allow_null=True)
+    toLocation = serializers.IntegerField(required=False, allow_null=True)
+    mutationType = serializers.ChoiceField(choices=models.StockMutation.TYPES, default='purchase')
+    amount = serializers.IntegerField()
+
+    def validate(self, attrs):
+        if attrs['mutationType'] in ('sales', 'move') and not attrs.get('fromLocation'):
+            raise serializers.ValidationError({'fromLocation': ['This field is required.']})
+
+        if attrs['mutationType'] in ('purchase', 'move') and not attrs.get('toLocation'):
+            raise serializers.ValidationError({'toLocation': ['This field is required.']})
+
+        return attrs
+
+    class Meta:
+        list_serializer_class = StockMutationBulkListSerializer
@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from apps.order.models import Order, OrderLine
+from . import autocomplete_index
+from . import models
+from . import report_cache
+from . import thumbnails
+
+
+def _orderline_key(product_id, order):
+    if order is None or order.get('order_type') != 'sales':
+        return None
+
+    return product_id, order['customer_id'], order['start_date']
+
+
+def _order_values(order_id):
+    return Order.objects.filter(pk=order_id).values('customer_id', 'start_date', 'order_type').first()
+
+
+@receiver(pre_save, sender=OrderLine)
+@receiver(pre_delete, sender=OrderLine)
+def orderline_remember_rollup_key(sender, instance, **kwargs):
+    instance._sales_rollup_key = None
+
+    if instance.pk and models.SalesRollup.objects.is_enabled():
+        old = sender.objects.filter(pk=instance.pk).values('product_relation_id', 'order_id').first()
+        if old:
+            instance._sales_rollup_key = _orderline_key(old['product_relation_id'], _order_values(old['order_id']))
+
+
+@receiver(post_save, sender=OrderLine)
+def orderline_update_rollup(sender, instance, **kwargs):
+    if not models.SalesRollup.objects.is_enabled():
+        report_cache.invalidate()
+        return
+
+    keys = [
+        getattr(instance, '_sales_rollup_key', None),
+        _orderline_key(instance.product_relation_id, _order_values(instance.order_id)),
+    ]
+
+    models.SalesRollup.objects.refresh(keys)
+
+    if any(keys):
+        report_cache.invalidate()
+
+
+@receiver(post_delete, sender=OrderLine)
+def orderline_delete_rollup(sender, instance, **kwargs):
+    if not models.SalesRollup.objects.is_enabled():
+        report_cache.invalidate()
+        return
+
+    key = getattr(instance, '_sales_rollup_key', None)
+    models.SalesRollup.objects.refresh([key])
+
+    if key:
+        report_cache.invalidate()
+
+
+@receiver(pre_save, sender=Order)
+def order_remember_rollup_keys(sender, instance, **kwargs):
+    instance._sales_rollup_keys = []
+
+    if instance.pk and models.SalesRollup.objects.is_enabled():
+        order = _order_values(instance.pk)
+        product_ids = OrderLine.objects.filter(order_id=instance.pk).values_list('product_relation_id', flat=True)
+        instance._sales_rollup_keys = [_orderline_key(product_id, order) for product_id in product_ids]
+
+
+@receiver(post_save, sender=Order)
+def order_update_rollup(sender, instance, created, **kwargs):
+    if created:
+        return
+
+    if not models.SalesRollup.objects.is_enabled():
+        report_cache.invalidate()
+        return
+
+    order = _order_values(instance.pk)
+    product_ids = OrderLine.objects.filter(order_id=instance.pk).values_list('product_relation_id', flat=True)
+    keys = getattr(instance, '_sales_rollup_keys', []) + [
+        _orderline_key(product_id, order) for product_id in product_ids
+    ]
+
+    models.SalesRollup.objects.refresh(keys)
+
+    if any(keys):
+        report_cache.invalidate()
+
+
+@receiver(post_save, sender=models.Product)
+@receiver(post_delete, sender=models.Product)
+@receiver(post_save, sender=models.StockMutation)
+@receiver(post_delete, sender=models.StockMutation)
+def invalidate_sales_reports(sender, instance, **kwargs):
+    report_cache.invalidate()
+
+
+@receiver(post_save, sender=models.Product)
+@receiver(post_save, sender=models.Supplier)
+def autocomplete_index_save(sender, instance, **kwargs):
+    autocomplete_index.changed(instance)
+
+
+@receiver(post_delete, sender=models.Product)
+@receiver(post_delete, sender=models.Supplier)
+def autocomplete_index_delete(sender, instance, **kwargs):
+    autocomplete_index.changed(instance, deleted=True)
+
+
+@receiver(post_delete, sender=models.Product)
+@receiver(post_delete, sender=models.StockLocation)
+@receiver(post_delete, sender=models.StockLocationInventory)
+def add_sync_tombstone(sender, instance, **kwargs):
+    models.SyncTombstone.objects.create(model=sender._meta.label_lower, object_id=instance.pk)
+
+
+@receiver(post_save, sender=models.Product)
+def product_image_derivatives(sender, instance, created=False, update_fields=None, **kwargs):
+    if update_fields is not None and 'image' not in update_fields:
+        return
+
+    if thumbnails.is_outdated(instance, created=created):
+        thumbnails.schedule(instance)
+
+
+@receiver(post_delete, sender=models.ProductImageDerivative)
+def delete_image_derivative_file(sender, instance, **kwargs):
+    storage, name = instance.image.storage, instance.image.name
+
+    if name:
+        transaction.on_commit(lambda: storage.delete(name))
@@ -0,0 +1,51 @@
+import base64
+import datetime
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+class ExpiredToken(ValueError):
+    pass
+
+
+def get_margin():
+    """
+    rows committed by transactions that were still open when a token was made can carry an
+    older `modified`, so tokens point this far back and those rows are sent again
+    """
+    return datetime.timedelta(seconds=getattr(settings, 'PURCHASE_SYNC_MARGIN', 60))
+
+
+def get_retention():
+    return datetime.timedelta(days=getattr(settings, 'PURCHASE_SYNC_TOMBSTONE_DAYS', 30))
+
+
+def make_token(now=None):
+    now = now or timezone.now()
+
+    return base64.urlsafe_b64encode((now - get_margin()).isoformat().encode('utf-8')).decode('ascii')
+
+
+def parse_token(token):
+    """
+    the moment a token stands for, raises InvalidToken or ExpiredToken
+    """
+    try:
+        since = parse_datetime(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError):
+        since = None
+
+    if since is None:
+        raise InvalidToken(token)
+
+    if since < timezone.now() - get_retention():
+        # tombstones this old may have been pruned
+        raise ExpiredToken(token)
+
+    return since
@@ -0,0 +1,28 @@
+from contextlib import contextmanager
+
+import pytest
+
+from apps.core.rest import count_queries
+from apps.purchase import report_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_report_cache():
+    report_cache.get_cache().clear()
+    yield
+
+
+@pytest.fixture
+def query_budget():
+    """
+    with query_budget(5) as queries: ... fails when the block runs more than 5 queries
+    """
+    @contextmanager
+    def budget(max_queries=None):
+        with count_queries() as queries:
+            yield queries
+
+        if max_queries is not None:
+            assert queries.count <= max_queries, '%d queries, the budget is %d' % (queries.count, max_queries)
+
+    return budget
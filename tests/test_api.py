@@ -1,13 +1,32 @@
+import io
+import json
 import pytest
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 
+import openpyxl
+from PIL import Image
+
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
 from django.urls import reverse
+from django.utils import timezone
 
 from tenant_schemas.utils import tenant_context
 from rest_framework import status
 
 from apps.customer.tests.factories import CustomerFactory
+from apps.order.models import OrderLine
+from apps.purchase import datagen
+from apps.purchase import jobs
+from apps.purchase import metrics
 from apps.purchase import models as purchase_models
+from apps.purchase import serializers
+from apps.purchase import sync
+from apps.purchase import thumbnails
+from apps.purchase import views
 from apps.purchase.tests import factories
 
 
@@ -31,6 +50,73 @@ class TestProductAPI:
         assert response.data['count'] == 1
         assert response.data['results'][0]['name'] == 'test'
 
+    def test_product_list_fields(self, member1, client1, planninguser1):
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            factories.ProductFactory(
+                name='test',
+            )
+
+        response = client1.get(reverse('purchase-product-list'), {'fields': 'id,name,show_name'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert set(response.data['results'][0].keys()) == {'id', 'name', 'show_name'}
+        assert response.data['results'][0]['show_name'] == 'test'
+
+        response = client1.get(reverse('purchase-product-list'), {'omit': 'image,price_purchase'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert 'image' not in response.data['results'][0]
+        assert 'price_purchase' not in response.data['results'][0]
+        assert response.data['results'][0]['name'] == 'test'
+
+    def test_product_list_etag(self, member1, client1, planninguser1):
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            product = factories.ProductFactory(
+                name='test',
+            )
+
+        response = client1.get(reverse('purchase-product-list'))
+
+        assert response.status_code == status.HTTP_200_OK
+        etag = response['ETag']
+        assert response.has_header('Last-Modified')
+
+        response = client1.get(reverse('purchase-product-list'), HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response['ETag'] == etag
+
+        # proxies that compress the response send the ETag back as a weak one
+        response = client1.get(reverse('purchase-product-list'), HTTP_IF_NONE_MATCH='W/%s' % etag)
+
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+        with tenant_context(member1.tenant):
+            product.name = 'changed'
+            product.save()
+
+        response = client1.get(reverse('purchase-product-list'), HTTP_IF_NONE_MATCH=etag)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] != etag
+        assert response.data['results'][0]['name'] == 'changed'
+
+        with tenant_context(member1.tenant):
+            factories.ProductFactory(name='zz another')
+
+        # a new row changes the count
+        response = client1.get(reverse('purchase-product-list'), HTTP_IF_NONE_MATCH=response['ETag'])
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 2
+
+        response = client1.get(reverse('purchase-product-list'), {'pagination': 'cursor'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert not response.has_header('ETag')
+
     def test_product_list_search(self, member1, client1, planninguser1):
         with tenant_context(member1.tenant):
             client1.force_login(planninguser1)
@@ -318,6 +404,265 @@ class TestProductAPI:
         assert response.data['result'][3]['order_name'] == 'customer 1'
         assert response.data['result'][3]['amount'] == 5
 
+    def test_product_total_sales_rollup(self, member1, client1, planninguser1, settings):
+        settings.PURCHASE_SALES_ROLLUP = True
+
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            product1 = factories.ProductFactory(
+                name='test product 1'
+            )
+
+            product2 = factories.ProductFactory(
+                name='test product 2'
+            )
+
+            location = factories.StockLocationFactory()
+
+        d = datetime.datetime.today().date()
+
+        response = client1.post(reverse('order-list'), {
+            'customer_id': '1234',
+            'order_name': 'customer 1',
+            'start_date': d,
+            'end_date': d,
+            'order_type': 'sales',
+            'orderlines': [
+                {
+                    'product_relation': product1.id,
+                    'location_relation': location.id,
+                    'amount': 10,
+                    'price_purchase': 1.00,
+                    'price_selling': 3.50
+                },
+                {
+                    'product_relation': product1.id,
+                    'location_relation': location.id,
+                    'amount': 10,
+                    'price_purchase': 1.00,
+                    'price_selling': 3.50
+                },
+                {
+                    'product_relation': product2.id,
+                    'location_relation': location.id,
+                    'amount': 5,
+                    'price_purchase': 0.50,
+                    'price_selling': 1.50
+                }
+            ]
+        }, format='json')
+
+        assert response.status_code == status.HTTP_201_CREATED
+
+        with tenant_context(member1.tenant):
+            rollup = purchase_models.SalesRollup.objects.get(product=product1)
+            assert rollup.amount == 20
+            assert rollup.customer_id == '1234'
+
+            assert purchase_models.SalesRollup.objects.rebuild() == 2
+
+        response = client1.get(reverse('purchase-product-total-sales'))
+
+        assert response.status_code == status.HTTP_200_OK
+
+        assert response.data['result'][0]['product_name'] == product1.name
+        assert response.data['result'][0]['amount'] == 20
+
+        assert response.data['result'][1]['product_name'] == product2.name
+        assert response.data['result'][1]['amount'] == 5
+
+    def test_product_total_sales_per_customer_export_stream(self, member1, client1, planninguser1):
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            planninguser1.is_staff = True
+            planninguser1.save()
+
+            product = factories.ProductFactory(name='test product 1')
+            location = factories.StockLocationFactory()
+
+        d = datetime.datetime.today().date()
+
+        for customer_id, order_name, amount in (('1234', 'customer 1', 10), ('5678', 'customer 2', 3)):
+            response = client1.post(reverse('order-list'), {
+                'customer_id': customer_id,
+                'order_name': order_name,
+                'start_date': d,
+                'end_date': d,
+                'order_type': 'sales',
+                'orderlines': [
+                    {
+                        'product_relation': product.id,
+                        'location_relation': location.id,
+                        'amount': amount,
+                        'price_purchase': 1.00,
+                        'price_selling': 3.50
+                    },
+                ]
+            }, format='json')
+
+            assert response.status_code == status.HTTP_201_CREATED
+
+        url = reverse('purchase-total-sales-per-customer-export')
+
+        response = client1.get('%s?stream=1' % url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.streaming
+
+        workbook = openpyxl.load_workbook(io.BytesIO(b''.join(response.streaming_content)))
+        streamed = list(workbook.active.values)
+
+        assert streamed[0][0] == 'order_name'
+        assert len(streamed) == 3
+
+        response = client1.get('%s?stream=0' % url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert not response.streaming
+
+        workbook = openpyxl.load_workbook(io.BytesIO(response.content))
+        rendered = {row[0]: row for row in workbook.active.values if row and row[0] in ('customer 1', 'customer 2')}
+
+        def normalize(row):
+            return [float(value) if isinstance(value, (int, float)) else value for value in row]
+
+        for row in streamed[1:]:
+            assert normalize(row) == normalize(rendered[row[0]][:len(row)])
+
+    def test_product_total_sales_profile(self, member1, client1, planninguser1, settings, tmp_path):
+        settings.PROFILE_DIR = str(tmp_path)
+
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+
+        url = '%s?_profile=1' % reverse('purchase-product-total-sales-per-product-customer')
+        response = client1.get(url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert 'X-Profile-Report' not in response
+
+        with tenant_context(member1.tenant):
+            planninguser1.is_staff = True
+            planninguser1.save()
+
+        response = client1.get(url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert 'db;dur=' in response['Server-Timing']
+
+        with open(str(tmp_path / response['X-Profile-Report'])) as f:
+            report = json.load(f)
+
+        assert report['action'] == 'total_sales_per_product_customer'
+        assert set(report['times']) == {'db', 'serializer', 'renderer', 'python'}
+        assert report['queries'] > 0
+        assert (tmp_path / response['X-Profile-Report'].replace('.json', '.prof')).exists()
+
+    def test_product_metrics(self, member1, client1, planninguser1, settings):
+        settings.PURCHASE_METRICS_TOKEN = 'secret'
+        metrics.clear()
+
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            factories.ProductFactory.create_batch(3)
+
+        response = client1.get(reverse('purchase-product-list'))
+        assert response.status_code == status.HTTP_200_OK
+
+        response = client1.get(reverse('purchase-metrics-list'))
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+        response = client1.get(reverse('purchase-metrics-list'), HTTP_AUTHORIZATION='Bearer secret')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'].startswith('text/plain')
+
+        labels = 'viewset="ProductViewset",action="list",tenant="%s"' % member1.tenant.schema_name
+        text = response.content.decode('utf-8')
+
+        assert 'purchase_request_seconds_count{%s} 1' % labels in text
+        assert 'purchase_db_seconds_count{%s} 1' % labels in text
+        assert 'purchase_serializer_seconds_count{%s} 1' % labels in text
+        assert 'purchase_serializer_seconds_sum{%s} 0.0' % labels not in text
+        assert 'purchase_render_seconds_count{%s} 1' % labels in text
+        assert 'purchase_response_rows_bucket{%s,le="10"} 1' % labels in text
+        assert 'purchase_response_rows_sum{%s} 3.0' % labels in text
+        assert 'purchase_response_bytes_count{%s} 1' % labels in text
+
+    def test_product_total_sales_async(self, member1, client1, planninguser1, settings, monkeypatch):
+        settings.PURCHASE_JOB_BACKEND = 'sync'
+        monkeypatch.setattr(jobs, '_executor', jobs.SyncExecutor())
+
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+
+        response = client1.get('%s?async=1' % reverse('purchase-product-total-sales'))
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        job_id = response.data['id']
+
+        response = client1.get(reverse('purchase-report-job-detail', kwargs={'pk': job_id}))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['status'] == jobs.DONE
+        assert response.data['result'] == []
+
+        response = client1.get(reverse('purchase-report-job-detail', kwargs={'pk': 'unknown'}))
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+        for value in ('0', 'false'):
+            response = client1.get(reverse('purchase-product-total-sales'), {'async': value})
+
+            assert response.status_code == status.HTTP_200_OK
+            assert response.data['result'] == []
+
+    def test_product_total_sales_cached(self, member1, client1, planninguser1):
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            product = factories.ProductFactory(
+                name='test product 1'
+            )
+
+            location = factories.StockLocationFactory()
+
+        d = datetime.datetime.today().date()
+
+        response = client1.post(reverse('order-list'), {
+            'customer_id': '1234',
+            'order_name': 'customer 1',
+            'start_date': d,
+            'end_date': d,
+            'order_type': 'sales',
+            'orderlines': [
+                {
+                    'product_relation': product.id,
+                    'location_relation': location.id,
+                    'amount': 10,
+                    'price_purchase': 1.00,
+                    'price_selling': 3.50
+                },
+            ]
+        }, format='json')
+
+        assert response.status_code == status.HTTP_201_CREATED
+
+        response = client1.get(reverse('purchase-product-total-sales'))
+        assert response.data['result'][0]['amount'] == 10
+
+        with tenant_context(member1.tenant):
+            # a queryset update sends no signals, so the cached report is served
+            OrderLine.objects.filter(product_relation=product).update(amount=12)
+
+        response = client1.get(reverse('purchase-product-total-sales'))
+        assert response.data['result'][0]['amount'] == 10
+
+        with tenant_context(member1.tenant):
+            product.save()
+
+        response = client1.get(reverse('purchase-product-total-sales'))
+        assert response.data['result'][0]['amount'] == 12
+
     def test_product_autocomplete(self, member1, client1, planninguser1):
         with tenant_context(member1.tenant):
             client1.force_login(planninguser1)
@@ -334,6 +679,42 @@ class TestProductAPI:
         assert len(response.data) == 1
         assert response.data[0]['name'] == 'test_product_autocomplete'
 
+    def test_product_autocomplete_limit(self, member1, client1, planninguser1):
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            factories.ProductFactory(
+                name='limited product'
+            )
+            factories.ProductFactory(
+                name='limited'
+            )
+            factories.ProductFactory(
+                name='another limited product'
+            )
+
+        response = client1.get('%s?q=limited&limit=2' % reverse('purchase-product-autocomplete'))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data) == 2
+
+    def test_product_autocomplete_index(self, member1, client1, planninguser1, settings):
+        settings.PURCHASE_AUTOCOMPLETE_INDEX = True
+
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            factories.ProductFactory(
+                name='indexed product'
+            )
+            factories.ProductFactory(
+                name='bla'
+            )
+
+        response = client1.get('%s?q=prod' % reverse('purchase-product-autocomplete'))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data) == 1
+        assert response.data[0]['name'] == 'indexed product'
+
     def test_product_create(self, member1, client1, planninguser1):
         with tenant_context(member1.tenant):
             client1.force_login(planninguser1)
@@ -355,6 +736,74 @@ class TestProductAPI:
         response = client1.get(reverse('purchase-product-list'))
         assert response.data['count'] == 1
 
+    def test_product_create_image_multipart(self, member1, client1, planninguser1, settings, tmp_path):
+        settings.MEDIA_ROOT = str(tmp_path)
+
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+
+        image = io.BytesIO()
+        Image.new('RGB', (20, 10)).save(image, 'PNG')
+
+        response = client1.post(reverse('purchase-product-list'), {
+            'name': 'test name',
+            'identifier': 'bla',
+            'price_purchase': '0.00',
+            'price_selling': '0.00',
+            'price_selling_alt': '0.00',
+            'price_purchase_ex': '0.00',
+            'price_selling_ex': '0.00',
+            'price_selling_alt_ex': '0.00',
+            'image': SimpleUploadedFile('test image.png', image.getvalue(), content_type='image/png'),
+        }, format='multipart')
+
+        assert response.status_code == status.HTTP_201_CREATED
+
+        with tenant_context(member1.tenant):
+            product = purchase_models.Product.objects.get(pk=response.data['id'])
+            assert product.image.name.startswith('purchase-images/')
+            assert product.image.name.endswith('test_image.png')
+            assert product.image.width == 20
+
+    def test_product_image_thumbnails(self, member1, client1, planninguser1, settings, tmp_path):
+        settings.MEDIA_ROOT = str(tmp_path)
+        settings.PURCHASE_IMAGE_THUMBNAIL_SIZES = (64, 256)
+
+        image = io.BytesIO()
+        Image.new('RGB', (400, 200)).save(image, 'PNG')
+
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            product = factories.ProductFactory(name='test')
+            product.image.save('test.png', ContentFile(image.getvalue()))
+
+            assert thumbnails.is_outdated(product)
+            assert thumbnails.build(product.id) == 2
+            assert not thumbnails.is_outdated(product)
+
+        response = client1.get(reverse('purchase-product-list'), {'image_size': 50})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['results'][0]['image'].endswith('/thumbnails/test_64.jpg')
+
+        response = client1.get(reverse('purchase-product-autocomplete'), {'q': 'test', 'image_size': 100})
+
+        assert response.data[0]['image'].endswith('/thumbnails/test_256.jpg')
+
+        with tenant_context(member1.tenant):
+            factories.StockLocationInventoryFactory(product=product, location=factories.StockLocationFactory())
+
+        response = client1.get(reverse('stocklocationinventory-list-full'), {'image_size': 50})
+
+        assert response.data['results'][0]['product']['image'].endswith('/thumbnails/test_64.jpg')
+
+        response = client1.get(reverse('purchase-product-list'))
+        assert response.data['results'][0]['image'].endswith('/test.png')
+
+        with tenant_context(member1.tenant):
+            derivative = purchase_models.ProductImageDerivative.objects.get(product=product, size=64)
+            assert derivative.image.width == 64
+
     def test_product_retrieve(self, member1, client1, planninguser1):
         with tenant_context(member1.tenant):
             client1.force_login(planninguser1)
@@ -446,17 +895,52 @@ class TestSupplierAPI:
         with tenant_context(member1.tenant):
             client1.force_login(planninguser1)
             factories.SupplierFactory(
-                name='test'
+                name='test'
+            )
+            factories.SupplierFactory(
+                name='bla'
+            )
+
+        response = client1.get('%s?q=test' % reverse('supplier-autocomplete'))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data) == 1
+        assert response.data[0]['name'] == 'test'
+
+    def test_supplier_autocomplete_fields(self, member1, client1, planninguser1):
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            factories.SupplierFactory(
+                name='test'
+            )
+
+        response = client1.get('%s?q=test&fields=name,value' % reverse('supplier-autocomplete'))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data) == 1
+        assert set(response.data[0].keys()) == {'id', 'name', 'value'}
+        assert response.data[0]['name'] == 'test'
+
+    def test_supplier_autocomplete_match(self, member1, client1, planninguser1):
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            factories.SupplierFactory(
+                name='Test Supplier'
             )
             factories.SupplierFactory(
-                name='bla'
+                name='100% supplier'
             )
 
-        response = client1.get('%s?q=test' % reverse('supplier-autocomplete'))
+        response = client1.get('%s?q=tEsT' % reverse('supplier-autocomplete'))
 
         assert response.status_code == status.HTTP_200_OK
-        assert len(response.data) == 1
-        assert response.data[0]['name'] == 'test'
+        assert [supplier['name'] for supplier in response.data] == ['Test Supplier']
+
+        # LIKE wildcards in the query match literally
+        response = client1.get('%s?q=%%25' % reverse('supplier-autocomplete'))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [supplier['name'] for supplier in response.data] == ['100% supplier']
 
     def test_supplier_create(self, member1, client1, planninguser1):
         with tenant_context(member1.tenant):
@@ -545,6 +1029,98 @@ class TestStockLocationAPI:
         assert response.data['count'] == 1
         assert response.data['results'][0]['name'] == 'test'
 
+    def test_stocklocation_modified_format(self, settings):
+        settings.USE_TZ = False
+        stocklocation = purchase_models.StockLocation(name='test')
+        stocklocation.modified = datetime.datetime(2024, 1, 2, 3, 4, 5, 678)
+
+        assert serializers.StockLocationSerializer(stocklocation).data['modified'] == '2024/01/02 03:04'
+
+        stocklocation.modified = datetime.datetime(2024, 1, 2, 3, 4, 5)
+
+        assert serializers.StockLocationSerializer(stocklocation).data['modified'] == '2024/01/02 03:04'
+
+    def test_stocklocation_modified_format_aware(self, settings):
+        settings.USE_TZ = True
+        settings.TIME_ZONE = 'UTC'
+        stocklocation = purchase_models.StockLocation(name='test')
+        stocklocation.modified = datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+
+        # the ISO string of an aware datetime is passed on as is
+        assert serializers.StockLocationSerializer(stocklocation).data['modified'] == '2024-01-02T03:04:05Z'
+
+    def test_stocklocation_changes(self, member1, client1, planninguser1, settings):
+        settings.PURCHASE_SYNC_MARGIN = 0
+
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            stocklocation1 = factories.StockLocationFactory(
+                name='test',
+            )
+
+        response = client1.get(reverse('stocklocation-changes'))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['results']) == 1
+        assert response.data['deleted'] == []
+        token = response.data['token']
+
+        with tenant_context(member1.tenant):
+            factories.StockLocationFactory(
+                name='nog een location',
+            )
+            stocklocation1_id = stocklocation1.id
+            stocklocation1.delete()
+
+        response = client1.get('%s?since=%s' % (reverse('stocklocation-changes'), token))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert [row['name'] for row in response.data['results']] == ['nog een location']
+        assert response.data['deleted'] == [stocklocation1_id]
+
+        token = sync.make_token(timezone.now() - datetime.timedelta(days=365))
+        response = client1.get('%s?since=%s' % (reverse('stocklocation-changes'), token))
+        assert response.status_code == status.HTTP_410_GONE
+
+        response = client1.get('%s?since=bla' % reverse('stocklocation-changes'))
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_prune_sync_tombstones(self, member1):
+        with tenant_context(member1.tenant):
+            purchase_models.SyncTombstone.objects.create(
+                model='purchase.stocklocation', object_id=1, deleted=timezone.now() - datetime.timedelta(days=365)
+            )
+            purchase_models.SyncTombstone.objects.create(model='purchase.stocklocation', object_id=2)
+
+        # runs in the tenant schema, not in the public one
+        call_command('prune_sync_tombstones', schemas=[member1.tenant.schema_name])
+
+        with tenant_context(member1.tenant):
+            assert list(purchase_models.SyncTombstone.objects.values_list('object_id', flat=True)) == [2]
+
+    def test_stocklocation_changes_pages(self, member1, client1, planninguser1, monkeypatch):
+        monkeypatch.setattr(views.StockLocationViewset, 'sync_page_size', 2)
+
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            factories.StockLocationFactory.create_batch(5)
+
+        url = reverse('stocklocation-changes')
+        ids = []
+
+        while url:
+            response = client1.get(url)
+
+            assert response.status_code == status.HTTP_200_OK
+            ids.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+
+            if url:
+                assert response.data['token'] is None
+
+        assert len(ids) == len(set(ids)) == 5
+        assert response.data['token']
+
     def test_stocklocation_list_search(self, member1, client1, planninguser1):
         with tenant_context(member1.tenant):
             client1.force_login(planninguser1)
@@ -638,6 +1214,47 @@ class TestStockMutationsAPI:
         assert response.status_code == status.HTTP_200_OK
         assert response.data['count'] == 1
 
+    def test_stockmutation_list_cursor(self, member1, client1, planninguser1):
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            factories.StockMutationFactory()
+            factories.StockMutationFactory()
+            factories.StockMutationFactory()
+
+        response = client1.get(reverse('stockmutation-list'), {'pagination': 'cursor', 'page_size': 2})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] is None
+        assert len(response.data['results']) == 2
+        assert response.data['next'] is not None
+
+        first_page_ids = [row['id'] for row in response.data['results']]
+
+        response = client1.get(response.data['next'])
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['results']) == 1
+        assert response.data['next'] is None
+        assert response.data['results'][0]['id'] not in first_page_ids
+
+    def test_stockmutation_list_estimated_count(self, member1, client1, planninguser1, monkeypatch):
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            factories.StockMutationFactory()
+
+        response = client1.get(reverse('stockmutation-list'))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 1
+        assert response.data['count_exact'] is True
+
+        monkeypatch.setattr(views.StockMutationViewset, 'estimate_count_threshold', -1)
+        response = client1.get(reverse('stockmutation-list'))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count_exact'] is False
+        assert response.data['count'] >= 0
+
     def test_stockmutation_create_sales(self, member1, client1, planninguser1):
         with tenant_context(member1.tenant):
             client1.force_login(planninguser1)
@@ -763,6 +1380,87 @@ class TestStockMutationsAPI:
 
         assert to_inventory.amount == 10
 
+    def test_stockmutation_bulk(self, member1, client1, planninguser1):
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            product = factories.ProductFactory()
+            fromLocation = factories.StockLocationFactory()
+            toLocation = factories.StockLocationFactory()
+
+        response = client1.post(reverse('stockmutation-bulk'), [
+            {
+                'product': product.id,
+                'toLocation': fromLocation.id,
+                'mutationType': 'purchase',
+                'amount': 10,
+            },
+            {
+                'product': product.id,
+                'toLocation': toLocation.id,
+                'fromLocation': fromLocation.id,
+                'mutationType': 'move',
+                'amount': 4,
+            },
+            {
+                'product': product.id,
+                'fromLocation': toLocation.id,
+                'mutationType': 'sales',
+                'amount': 1,
+            },
+        ], format='json')
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data['count'] == 3
+
+        response = client1.get(reverse('stockmutation-list'))
+        assert response.data['count'] == 3
+
+        from_inventory = purchase_models.StockLocationInventory.objects.get(
+            product=product,
+            location=fromLocation
+        )
+
+        assert from_inventory.amount == 6
+
+        to_inventory = purchase_models.StockLocationInventory.objects.get(
+            product=product,
+            location=toLocation
+        )
+
+        assert to_inventory.amount == 3
+
+    def test_stockmutation_bulk_invalid(self, member1, client1, planninguser1):
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            product = factories.ProductFactory()
+
+        response = client1.post(reverse('stockmutation-bulk'), [
+            {
+                'product': product.id,
+                'mutationType': 'purchase',
+                'amount': 10,
+            },
+        ], format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert purchase_models.StockMutation.objects.count() == 0
+
+    def test_stockmutation_bulk_max(self, member1, client1, planninguser1, settings):
+        settings.PURCHASE_STOCK_MUTATION_BULK_MAX = 2
+
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            product = factories.ProductFactory()
+            location = factories.StockLocationFactory()
+
+        mutation = {'product': product.id, 'toLocation': location.id, 'mutationType': 'purchase', 'amount': 1}
+        response = client1.post(reverse('stockmutation-bulk'), [mutation] * 3, format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        with tenant_context(member1.tenant):
+            assert purchase_models.StockMutation.objects.count() == 0
+
     def test_stockmutation_retrieve(self, member1, client1, planninguser1):
         with tenant_context(member1.tenant):
             client1.force_login(planninguser1)
@@ -876,6 +1574,155 @@ class TestStockmutationInventoryAPI:
         assert response.data['count'] == 1
         assert response.data['results'][0]['amount'] == 5
 
+    def test_stocklocationinventory_list_as_of(self, member1, client1, planninguser1):
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            product = factories.ProductFactory()
+            location = factories.StockLocationFactory()
+
+            purchase_models.StockMutation.objects.create(
+                product=product,
+                toLocation=location,
+                mutationType='purchase',
+                amount=10,
+            )
+
+            purchase_models.StockInventorySnapshot.objects.take()
+
+            purchase_models.StockMutation.objects.create(
+                product=product,
+                fromLocation=location,
+                mutationType='sales',
+                amount=3,
+            )
+
+        now = datetime.datetime.now()
+        url = reverse('stocklocationinventory-list')
+
+        response = client1.get(url, {'as_of': now.isoformat()})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 1
+        assert response.data['results'][0]['amount'] == 7
+
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        response = client1.get(url, {'as_of': yesterday.isoformat()})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 0
+
+        response = client1.get(url, {'as_of': 'yesterday'})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        response = client1.get(url, {'as_of': '2024-02-30'})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        response = client1.get(url, {'as_of': now.isoformat(), 'product': 'abc'})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'product' in response.data
+
+        response = client1.get(url, {'as_of': now.isoformat(), 'pagination': 'cursor'})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_stocklocationinventory_as_of_late_mutation(self, member1):
+        with tenant_context(member1.tenant):
+            product = factories.ProductFactory()
+            location = factories.StockLocationFactory()
+
+            snapshot = purchase_models.StockInventorySnapshot.objects.take()
+
+            # stamped before the snapshot, committed after it
+            mutation = purchase_models.StockMutation.objects.create(
+                product=product,
+                toLocation=location,
+                mutationType='purchase',
+                amount=4,
+            )
+            purchase_models.StockMutation.objects.filter(pk=mutation.pk).update(
+                created=snapshot.taken - datetime.timedelta(seconds=1)
+            )
+
+            amounts = purchase_models.StockInventorySnapshot.objects.get_amounts_at(timezone.now())
+
+        assert amounts == {(product.id, location.id): 4}
+
+    def test_stocklocationinventory_list_full(self, member1, client1, planninguser1):
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            product1 = factories.ProductFactory()
+            product2 = factories.ProductFactory()
+            location = factories.StockLocationFactory()
+
+            factories.StockLocationInventoryFactory(
+                product=product1,
+                location=location,
+                amount=5,
+            )
+
+            factories.StockLocationInventoryFactory(
+                product=product2,
+                location=location,
+                amount=5,
+            )
+
+        d = datetime.datetime.today().date()
+
+        response = client1.post(reverse('order-list'), {
+            'customer_id': '1234',
+            'order_name': 'customer 1',
+            'start_date': d,
+            'end_date': d,
+            'order_type': 'sales',
+            'orderlines': [
+                {
+                    'product_relation': product1.id,
+                    'location_relation': location.id,
+                    'amount': 2,
+                    'price_purchase': 1.00,
+                    'price_selling': 3.50
+                },
+                {
+                    'product_relation': product1.id,
+                    'location_relation': location.id,
+                    'amount': 1,
+                    'price_purchase': 1.00,
+                    'price_selling': 3.50
+                },
+            ]
+        }, format='json')
+
+        assert response.status_code == status.HTTP_201_CREATED
+
+        response = client1.get(reverse('stocklocationinventory-list-full'))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['count'] == 2
+
+        amounts = {row['product']['id']: row['sales_amount_today'] for row in response.data['results']}
+        assert amounts == {product1.id: 3, product2.id: 0}
+
+    def test_stocklocationinventory_list_full_fields(self, member1, client1, planninguser1):
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            product = factories.ProductFactory(
+                name='test product'
+            )
+
+            factories.StockLocationInventoryFactory(
+                product=product,
+                amount=5,
+            )
+
+        response = client1.get(reverse('stocklocationinventory-list-full'), {'fields': 'id,amount,product.name'})
+
+        assert response.status_code == status.HTTP_200_OK
+        assert set(response.data['results'][0].keys()) == {'id', 'amount', 'product'}
+        assert response.data['results'][0]['product'] == {'name': 'test product'}
+
     def test_stocklocationinventory_list_product_types(self, member1, client1, planninguser1):
         with tenant_context(member1.tenant):
             client1.force_login(planninguser1)
@@ -891,6 +1738,10 @@ class TestStockmutationInventoryAPI:
                 product_type='type 3'
             )
 
+            prod4 = factories.ProductFactory(
+                product_type='type 1'
+            )
+
             loc1 = factories.StockLocationFactory()
 
             factories.StockLocationInventoryFactory(
@@ -900,7 +1751,7 @@ class TestStockmutationInventoryAPI:
             )
 
             factories.StockLocationInventoryFactory(
-                product=prod1,
+                product=prod4,
                 location=loc1,
                 amount=15,
             )
@@ -995,3 +1846,142 @@ class TestStockmutationInventoryAPI:
         response = client1.delete(url, format='json')
 
         assert response.status_code == status.HTTP_204_NO_CONTENT
+
+
+def get_rows(data):
+    if isinstance(data, list):
+        return len(data)
+
+    if 'count' in data:
+        return data['count']
+
+    return len(data['results'])
+
+
+QUERY_BUDGETS = [
+    # url name, params, factory, factory kwargs
+    ('purchase-product-list', {}, factories.ProductFactory, {'image': 'test.png'}),
+    ('purchase-product-list', {'image_size': 64}, factories.ProductFactory, {'image': 'test.png'}),
+    ('purchase-product-autocomplete', {'q': 'budget'}, factories.ProductFactory, {'name': 'budget product'}),
+    ('purchase-product-changes', {}, factories.ProductFactory, {}),
+    ('supplier-list', {}, factories.SupplierFactory, {}),
+    ('stockmutation-list', {}, factories.StockMutationFactory, {'mutationType': 'move'}),
+    ('stocklocationinventory-list', {}, factories.StockLocationInventoryFactory, {}),
+    ('stocklocationinventory-list-full', {}, factories.StockLocationInventoryFactory, {}),
+    ('stocklocationinventory-list-full', {'image_size': 64}, factories.StockLocationInventoryFactory,
+     {'product__image': 'test.png'}),
+]
+
+
+@pytest.mark.django_db
+class TestQueryBudget:
+    @pytest.mark.parametrize('url_name,params,factory,kwargs', QUERY_BUDGETS)
+    def test_query_budget(self, member1, client1, planninguser1, query_budget, settings,
+                          url_name, params, factory, kwargs):
+        settings.QUERY_COUNT_HEADERS = True
+
+        with tenant_context(member1.tenant):
+            client1.force_login(planninguser1)
+            factory(**kwargs)
+
+        with query_budget() as queries:
+            response = client1.get(reverse(url_name), params)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert get_rows(response.data) == 1
+
+        # the middleware queries are not counted by the viewset
+        assert 0 < int(response['X-Query-Count']) <= queries.count
+        assert 'X-Query-Time' in response
+
+        with tenant_context(member1.tenant):
+            factory.create_batch(5, **kwargs)
+
+        # more rows, no extra queries
+        with query_budget(queries.count):
+            response = client1.get(reverse(url_name), params)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert get_rows(response.data) == 6
+
+
+@pytest.mark.django_db(transaction=True)
+class TestStockMutationConcurrency:
+    def test_parallel_mutations(self, member1):
+        with tenant_context(member1.tenant):
+            product = factories.ProductFactory()
+            location = factories.StockLocationFactory()
+
+        def mutate(amount):
+            try:
+                with tenant_context(member1.tenant):
+                    purchase_models.StockMutation.objects.create(
+                        product=product,
+                        toLocation=location,
+                        mutationType='purchase',
+                        amount=amount,
+                    )
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(mutate, [1] * 50))
+
+        with tenant_context(member1.tenant):
+            inventory = purchase_models.StockLocationInventory.objects.get(
+                product=product,
+                location=location
+            )
+
+            assert inventory.amount == 50
+            assert purchase_models.StockMutation.objects.filter(product=product).count() == 50
+
+
+@pytest.mark.django_db
+class TestGeneratePurchaseData:
+    def test_generate(self, member1):
+        options = {
+            'suppliers': 5,
+            'products': 20,
+            'locations': 3,
+            'inventory': 30,
+            'mutations': 10,
+            'customers': 4,
+            'orderlines': 25,
+            'batch_size': 7,
+        }
+
+        with tenant_context(member1.tenant):
+            counts = datagen.Generator(**options).generate()
+
+            assert counts['Product'] == 20
+            assert counts['OrderLine'] == 25
+            assert counts['Order'] == 3
+            # the mutations can add rows for new (product, location) pairs
+            assert purchase_models.StockLocationInventory.objects.count() >= 30
+            assert purchase_models.StockMutation.objects.count() == 10
+            assert OrderLine.objects.filter(product_relation__in=purchase_models.Product.objects.all()).count() == 25
+
+        def names(seed):
+            generator = datagen.Generator(seed=seed)
+            return [generator.build_product(i).name for i in range(10)]
+
+        assert names(1) == names(1)
+        assert names(1) != names(2)
+
+    def test_generate_inventory_follows_mutations(self, member1):
+        with tenant_context(member1.tenant):
+            datagen.Generator(suppliers=0, products=5, locations=3, inventory=0, mutations=50, orderlines=0,
+                              batch_size=7).generate()
+
+            expected = {}
+            for mutation in purchase_models.StockMutation.objects.all():
+                for key, amount in mutation.get_inventory_deltas().items():
+                    expected[key] = expected.get(key, 0) + amount
+
+            amounts = {
+                (row.product_id, row.location_id): row.amount
+                for row in purchase_models.StockLocationInventory.objects.all()
+            }
+
+            assert amounts == expected
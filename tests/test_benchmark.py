@@ -0,0 +1,199 @@
+"""
+Timings of the purchase endpoints at production data sizes, skipped unless PURCHASE_BENCHMARK is set:
+
+    PURCHASE_BENCHMARK=1 PURCHASE_BENCHMARK_ORDERLINES=10000,100000,1000000 pytest apps/purchase/tests/test_benchmark.py
+
+Every volume writes benchmark-<orderlines>.json to PURCHASE_BENCHMARK_DIR, compare those between runs.
+"""
+import datetime
+import json
+import os
+import platform
+import statistics
+import time
+
+import pytest
+
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from tenant_schemas.utils import tenant_context
+
+from apps.core.rest import count_queries
+from apps.order.models import Order, OrderLine
+from apps.purchase import models as purchase_models
+from apps.purchase import report_cache
+from apps.purchase.tests import factories
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+ORDERLINE_VOLUMES = [int(value) for value in os.environ.get('PURCHASE_BENCHMARK_ORDERLINES', '10000').split(',')]
+PRODUCTS = _env_int('PURCHASE_BENCHMARK_PRODUCTS', 100000)
+INVENTORY = _env_int('PURCHASE_BENCHMARK_INVENTORY', 50000)
+LOCATIONS = _env_int('PURCHASE_BENCHMARK_LOCATIONS', 50)
+CUSTOMERS = _env_int('PURCHASE_BENCHMARK_CUSTOMERS', 1000)
+LINES_PER_ORDER = 10
+REPEAT = _env_int('PURCHASE_BENCHMARK_REPEAT', 3)
+BATCH_SIZE = 2000
+
+pytestmark = pytest.mark.skipif(not os.environ.get('PURCHASE_BENCHMARK'), reason='set PURCHASE_BENCHMARK=1 to run')
+
+
+def seed(orderlines):
+    """
+    build the rows with the factories and store them with bulk_create, signals don't fire so the rollup is rebuilt
+    """
+    products = purchase_models.Product.objects.bulk_create(
+        factories.ProductFactory.build_batch(PRODUCTS), batch_size=BATCH_SIZE
+    )
+    locations = purchase_models.StockLocation.objects.bulk_create(
+        factories.StockLocationFactory.build_batch(LOCATIONS), batch_size=BATCH_SIZE
+    )
+    factories.SupplierFactory.create_batch(100)
+
+    purchase_models.StockLocationInventory.objects.bulk_create([
+        factories.StockLocationInventoryFactory.build(product=products[i], location=locations[i % LOCATIONS])
+        for i in range(min(INVENTORY, PRODUCTS))
+    ], batch_size=BATCH_SIZE)
+
+    purchase_models.StockMutation.objects.bulk_create([
+        factories.StockMutationFactory.build(
+            product=products[i % PRODUCTS],
+            fromLocation=locations[i % LOCATIONS],
+            toLocation=locations[(i + 1) % LOCATIONS],
+            mutationType='move'
+        )
+        for i in range(INVENTORY)
+    ], batch_size=BATCH_SIZE)
+
+    start = datetime.date(timezone.now().year, 1, 1)
+    days = max((timezone.now().date() - start).days, 1)
+
+    orders = Order.objects.bulk_create([
+        Order(
+            customer_id='%d' % (i % CUSTOMERS),
+            order_name='customer %d' % (i % CUSTOMERS),
+            start_date=start + datetime.timedelta(days=i % days),
+            end_date=start + datetime.timedelta(days=i % days),
+            order_type='sales',
+        )
+        for i in range(max(orderlines // LINES_PER_ORDER, 1))
+    ], batch_size=BATCH_SIZE)
+
+    OrderLine.objects.bulk_create([
+        OrderLine(
+            order=orders[i // LINES_PER_ORDER % len(orders)],
+            product_relation=products[i * 7 % PRODUCTS],
+            location_relation=locations[i % LOCATIONS],
+            amount=1 + i % 5,
+            price_purchase=1.00,
+            price_selling=3.50,
+        )
+        for i in range(orderlines)
+    ], batch_size=BATCH_SIZE)
+
+    purchase_models.SalesRollup.objects.rebuild()
+
+    return products, locations
+
+
+def get_endpoints(products, locations):
+    """
+    (name, method, url, data), the report caches are cleared before every call and the writes are rolled back
+    """
+    mutation = {
+        'product': products[0].id,
+        'fromLocation': locations[0].id,
+        'toLocation': locations[1].id,
+        'amount': 1,
+        'mutationType': 'move',
+    }
+
+    return [
+        ('product list', 'get', reverse('purchase-product-list'), None),
+        ('product autocomplete', 'get', '%s?q=a' % reverse('purchase-product-autocomplete'), None),
+        ('product changes', 'get', reverse('purchase-product-changes'), None),
+        ('total_sales', 'get', reverse('purchase-product-total-sales'), None),
+        ('total_sales_per_customer', 'get', reverse('purchase-product-total-sales-per-customer'), None),
+        ('total_sales_per_product_customer', 'get', reverse('purchase-product-total-sales-per-product-customer'),
+         None),
+        ('total_sales_per_customer export', 'get',
+         '%s?stream=1' % reverse('purchase-total-sales-per-customer-export'), None),
+        ('supplier list', 'get', reverse('supplier-list'), None),
+        ('supplier autocomplete', 'get', '%s?q=a' % reverse('supplier-autocomplete'), None),
+        ('stocklocation list', 'get', reverse('stocklocation-list'), None),
+        ('stockmutation list', 'get', reverse('stockmutation-list'), None),
+        ('stockmutation list cursor', 'get', '%s?pagination=cursor' % reverse('stockmutation-list'), None),
+        ('stockmutation create', 'post', reverse('stockmutation-list'), mutation),
+        ('stockmutation bulk', 'post', reverse('stockmutation-bulk'), [mutation] * 100),
+        ('inventory list', 'get', reverse('stocklocationinventory-list'), None),
+        ('inventory list_full', 'get', reverse('stocklocationinventory-list-full'), None),
+        ('inventory list_product_types', 'get',
+         '%s?location_id=%d' % (reverse('stocklocationinventory-list-product-types'), locations[0].id), None),
+    ]
+
+
+def measure(client, method, url, data):
+    timings = []
+    queries = []
+
+    for i in range(REPEAT):
+        report_cache.get_cache().clear()
+
+        # every repeat of a write starts from the seeded rows
+        with transaction.atomic(), count_queries() as counter:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, data, format='json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            timings.append(time.perf_counter() - start)
+
+            transaction.set_rollback(True)
+
+        assert response.status_code < 400, '%s %s: %s' % (method, url, response.status_code)
+        queries.append(counter.count)
+
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'max': max(timings),
+        'queries': max(queries),
+    }
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('orderlines', ORDERLINE_VOLUMES)
+def test_benchmark(member1, client1, planninguser1, orderlines):
+    with tenant_context(member1.tenant):
+        planninguser1.is_staff = True
+        planninguser1.save()
+        client1.force_login(planninguser1)
+
+        start = time.perf_counter()
+        products, locations = seed(orderlines)
+        seeded = time.perf_counter() - start
+
+    results = {}
+    for name, method, url, data in get_endpoints(products, locations):
+        results[name] = measure(client1, method, url, data)
+
+    output = os.path.join(os.environ.get('PURCHASE_BENCHMARK_DIR', '.'), 'benchmark-%d.json' % orderlines)
+    with open(output, 'w') as f:
+        json.dump({
+            'created': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'volumes': {
+                'orderlines': orderlines,
+                'products': PRODUCTS,
+                'inventory': INVENTORY,
+                'locations': LOCATIONS,
+                'customers': CUSTOMERS,
+            },
+            'repeat': REPEAT,
+            'seed_seconds': seeded,
+            'results': results,
+        }, f, indent=2, sort_keys=True)
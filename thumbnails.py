@@ -0,0 +1,178 @@
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from PIL import Image
+
+from . import jobs
+from . import models
+from . import report_cache
+
+EXTENSIONS = {
+    'jpeg': 'jpg',
+    'webp': 'webp',
+}
+
+
+def get_sizes():
+    """
+    the sizes thumbnails are built in, the longest side in pixels
+    """
+    return tuple(sorted(getattr(settings, 'PURCHASE_IMAGE_THUMBNAIL_SIZES', (64, 256))))
+
+
+def get_formats():
+    if getattr(settings, 'PURCHASE_IMAGE_WEBP', False):
+        return 'jpeg', 'webp'
+
+    return 'jpeg',
+
+
+def get_size(value):
+    """
+    the smallest built size that covers value, the largest when none does, None for the original
+    """
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+
+    sizes = get_sizes()
+    if value <= 0 or not sizes:
+        return None
+
+    for size in sizes:
+        if size >= value:
+            return size
+
+    return sizes[-1]
+
+
+def get_format(value):
+    return value if value in get_formats() else 'jpeg'
+
+
+def get_request_options(request):
+    """
+    (size, format) asked for with ?image_size= and ?image_format=
+    """
+    if request is None:
+        return None, None
+
+    return get_size(request.query_params.get('image_size')), get_format(request.query_params.get('image_format'))
+
+
+def get_urls(product_ids, size, format='jpeg'):
+    """
+    {product id: thumbnail url} for the products that have an up to date thumbnail
+    """
+    product_ids = set(product_ids)
+    if size is None or not product_ids:
+        return {}
+
+    derivatives = models.ProductImageDerivative.objects.filter(
+        product_id__in=product_ids,
+        size=size,
+        format=format,
+        source=F('product__image')
+    ).values_list('product_id', 'image')
+
+    storage = models.ProductImageDerivative._meta.get_field('image').storage
+
+    return {product_id: storage.url(name) for product_id, name in derivatives}
+
+
+def is_outdated(product, created=False):
+    """
+    whether the thumbnails of product have to be (re)built, or removed when it has no image
+    """
+    if not product.image:
+        # a new product without an image has nothing to build or remove
+        if created:
+            return False
+
+        return models.ProductImageDerivative.objects.filter(product=product).exists()
+
+    expected = len(get_sizes()) * len(get_formats())
+    if created:
+        return expected > 0
+
+    return models.ProductImageDerivative.objects.filter(
+        product=product, source=product.image.name
+    ).count() != expected
+
+
+def render(image, size, format):
+    thumbnail = image.copy()
+    thumbnail.thumbnail((size, size))
+
+    if format == 'jpeg' and thumbnail.mode not in ('RGB', 'L'):
+        thumbnail = thumbnail.convert('RGB')
+
+    content = io.BytesIO()
+    thumbnail.save(content, format.upper(), quality=85)
+
+    return content.getvalue()
+
+
+def build(product_id):
+    """
+    (re)build the thumbnails of a product, returns how many were stored
+    """
+    product = models.Product.objects.filter(pk=product_id).first()
+    if product is None:
+        return 0
+
+    source = product.image.name
+    derivatives = []
+
+    if source:
+        with product.image.open('rb') as f:
+            image = Image.open(f)
+            image.load()
+
+        name = os.path.splitext(os.path.basename(source))[0]
+
+        for size in get_sizes():
+            for format in get_formats():
+                derivative = models.ProductImageDerivative(product=product, source=source, size=size, format=format)
+                derivative.image.save(
+                    '%s_%s.%s' % (name, size, EXTENSIONS[format]),
+                    ContentFile(render(image, size, format)),
+                    save=False
+                )
+                derivatives.append(derivative)
+
+    with transaction.atomic():
+        current = models.Product.objects.select_for_update().filter(pk=product_id).values_list('image', flat=True)
+
+        if list(current) != [source]:
+            # the image changed while we worked, the job for the new one replaces everything
+            for derivative in derivatives:
+                derivative.image.delete(save=False)
+
+            return 0
+
+        # the files of replaced derivatives are removed by a post_delete signal
+        models.ProductImageDerivative.objects.filter(product_id=product_id).delete()
+        models.ProductImageDerivative.objects.bulk_create(derivatives)
+        # clients syncing or caching products pick up the new thumbnails
+        models.Product.objects.filter(pk=product_id).update(modified=timezone.now())
+
+    # reports hold image urls
+    report_cache.invalidate()
+
+    return len(derivatives)
+
+
+def schedule(product):
+    """
+    build the thumbnails of product in the background once the current transaction commits
+    """
+    product_id = product.pk
+    transaction.on_commit(lambda: jobs.submit(build, product_id))
@@ -13,3 +13,5 @@ purchase.register(r'supplier', views.SupplierViewset)
 purchase.register(r'stock-location', views.StockLocationViewset)
 purchase.register(r'stock-mutation', views.StockMutationViewset)
 purchase.register(r'stock-location-inventory', views.StockLocationInventoryViewset)
+purchase.register(r'report-job', views.ReportJobViewset, basename='purchase-report-job')
+purchase.register(r'metrics', views.MetricsViewset, basename='purchase-metrics')
@@ -1,14 +1,19 @@
 import datetime
-from operator import itemgetter
 
 from django.conf import settings
-from django.db.models import Q, Subquery, Sum
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db.models import F, Max, Min, Prefetch, Q, Subquery, Sum
+from django.http import Http404
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.views.generic.base import TemplateView
 
 from braces.views import LoginRequiredMixin
-from rest_framework import renderers
+from rest_framework import parsers, renderers, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 
 from drf_renderer_xlsx.mixins import XLSXFileMixin
 from drf_renderer_xlsx.renderers import XLSXRenderer
@@ -16,8 +21,16 @@ from drf_renderer_xlsx.renderers import XLSXRenderer
 from apps.core import permissions
 from apps.core.rest import BaseMy24ViewSet, BaseListView
 from apps.order.models import OrderLine
+from . import autocomplete_index
+from . import exports
+from . import jobs
+from . import metrics
 from . import models
+from . import report_cache
+from . import search
 from . import serializers
+from . import sync
+from . import thumbnails
 
 
 class PurchaseIndex(LoginRequiredMixin, TemplateView):
@@ -28,103 +41,215 @@ class PurchaseDeviceIndex(LoginRequiredMixin, TemplateView):
     template_name = 'purchase/device.html'
 
 
+ORDERLINE_SALES_FIELDS = {
+    'product': 'product_relation',
+    'product_name': 'product_relation__name',
+    'product_image': 'product_relation__image',
+    'customer': 'order__customer_id',
+    'customer_name': 'order__order_name',
+    'date': 'order__start_date',
+    'purchase_currency': 'price_purchase_currency',
+    'selling_currency': 'price_selling_currency',
+}
+
+ROLLUP_SALES_FIELDS = {
+    'product': 'product',
+    'product_name': 'product__name',
+    'product_image': 'product__image',
+    'customer': 'customer_id',
+    'customer_name': 'order_name',
+    'date': 'day',
+    'purchase_currency': 'price_purchase_currency',
+    'selling_currency': 'currency',
+}
+
+SALES_GROUPS = {
+    'product': ('product', 'product_name', 'product_image'),
+    'customer': ('customer',),
+}
+
+# report name: (groups, fields searched by `q`, include profit)
+SALES_REPORTS = {
+    'total_sales': (('product',), ('product_name',), True),
+    'total_sales_per_customer': (('customer',), ('customer_name',), True),
+    'total_sales_per_product_customer': (('customer', 'product'), ('customer_name', 'product_name'), False),
+}
+
+
+def _image_url(name):
+    if not name:
+        return ''
+
+    return models.Product._meta.get_field('image').storage.url(name)
+
+
+def is_flag_set(request, name):
+    """
+    ?name=1 turns a flag on, a missing value, '', '0' and 'false' leave it off
+    """
+    return request.query_params.get(name, '0') not in ('', '0', 'false')
+
+
+def _perc(value, total):
+    if not total:
+        return 0
+
+    return round((value / total) * 100, 2)
+
+
 class ProductQueryMixin(object):
-    def get_totals(self, year):
-        filter_q = Q(product_relation__in=Subquery(self.queryset.values('id')),
-                     order__order_type='sales', order__start_date__year=year)
+    def use_sales_rollup(self):
+        return models.SalesRollup.objects.is_enabled()
 
-        return OrderLine.objects.filter(filter_q).aggregate(Sum('price_selling'), Sum('amount'), Sum('price_purchase'))
+    def get_sales_source(self):
+        """
+        the table the sales reports read from and how its columns are named
+        """
+        if self.use_sales_rollup():
+            return models.SalesRollup.objects.all(), ROLLUP_SALES_FIELDS
 
-    def get_total_sales(self, year, query):
-        totals = self.get_totals(year)
+        return OrderLine.objects.filter(order__order_type='sales'), ORDERLINE_SALES_FIELDS
 
-        product_row = {}
+    def get_sales_filter(self, year, fields):
+        return Q(**{
+            '%s__in' % fields['product']: Subquery(self.queryset.values('id')),
+            '%s__year' % fields['date']: year,
+        })
 
-        filter_q = Q(product_relation__in=Subquery(self.queryset.values('id')),
-                     order__order_type='sales', order__start_date__year=year)
+    def get_totals(self, year):
+        qs, fields = self.get_sales_source()
 
-        if query:
-            filter_q = filter_q & Q(product_relation__name__icontains=query)
+        return qs.filter(self.get_sales_filter(year, fields)).aggregate(
+            Sum('price_selling'), Sum('amount'), Sum('price_purchase')
+        )
 
-        for orderline in OrderLine.objects.filter(filter_q).select_related('order').select_related('product_relation'):
+    def get_sales_rows(self, year, groups, query_fields=(), query=None):
+        """
+        group sales in the database, one row per distinct value of `groups`
+        """
+        qs, fields = self.get_sales_source()
+        filter_q = self.get_sales_filter(year, fields)
 
-            if orderline.product_relation.id in product_row:
-                product_row[orderline.product_relation.id]['amount'] += orderline.amount
-                product_row[orderline.product_relation.id]['price_purchase_amount'] += orderline.price_purchase.amount
-                product_row[orderline.product_relation.id]['price_selling_amount'] += orderline.price_selling.amount
+        if query:
+            query_q = Q()
+            for name in query_fields:
+                query_q |= Q(**{'%s__icontains' % fields[name]: query})
+
+            filter_q = filter_q & query_q
+
+        group_by = {}
+        for group in groups:
+            for name in SALES_GROUPS[group]:
+                group_by['report_%s' % name] = F(fields[name])
+
+        extra = {}
+        if 'customer' in groups:
+            extra['report_customer_name'] = Max(fields['customer_name'])
+
+        return qs.\
+            filter(filter_q).\
+            order_by().\
+            values(**group_by).\
+            annotate(
+                amount_sum=Sum('amount'),
+                price_purchase_amount=Sum('price_purchase'),
+                price_selling_amount=Sum('price_selling'),
+                report_purchase_currency=Max(fields['purchase_currency']),
+                report_selling_currency=Max(fields['selling_currency']),
+                first_id=Min('id'),
+                **extra
+            ).\
+            order_by('-price_selling_amount', 'first_id')
+
+    def get_sales_row(self, row, totals, profit=True, image_urls=None):
+        """
+        turn an aggregated row into a report row, image_urls {product id: url} replaces the original images
+        """
+        result = {
+            'amount': row['amount_sum'],
+            'price_purchase_amount': row['price_purchase_amount'],
+            'price_purchase_currency': '%s' % row['report_purchase_currency'],
+            'price_selling_amount': row['price_selling_amount'],
+            'price_selling_currency': '%s' % row['report_selling_currency'],
+        }
+
+        if 'report_product' in row:
+            if image_urls and row['report_product'] in image_urls:
+                result['product_image'] = image_urls[row['report_product']]
             else:
-                product_row[orderline.product_relation.id] = {
-                    'product_image': orderline.product_relation.image.url if orderline.product_relation.image else '',
-                    'product_name': orderline.product_relation.name,
-                    'amount': orderline.amount,
-                    'price_purchase_amount': orderline.price_purchase.amount,
-                    'price_purchase_currency': '%s' % orderline.price_purchase.currency,
-                    'price_selling_amount': orderline.price_selling.amount,
-                    'price_selling_currency': '%s' % orderline.price_selling.currency,
-                }
-
-        response = []
-
-        # for row in result:
-        for key in product_row.keys():
-            profit = round(product_row[key]['price_selling_amount'] - product_row[key]['price_purchase_amount'], 2)
-            product_row[key]['profit'] = profit
-
-            price_selling_amount = product_row[key]['price_selling_amount']
-            amount = product_row[key]['amount']
-
-            product_row[key]['amount_perc'] = round((amount / totals['amount__sum']) * 100, 2)
-            product_row[key]['amount_selling_perc'] = round(
-                (price_selling_amount / totals['price_selling__sum']) * 100, 2
-            )
+                result['product_image'] = _image_url(row['report_product_image'])
+            result['product_name'] = row['report_product_name']
 
-            response.append(product_row[key])
+        if 'report_customer' in row:
+            result['order_name'] = row['report_customer_name']
 
-        return sorted(response, key=itemgetter('price_selling_amount'), reverse=True)
+        if profit:
+            result['profit'] = round(result['price_selling_amount'] - result['price_purchase_amount'], 2)
 
-    def get_total_sales_per_customer(self, year, query):
+        result['amount_perc'] = _perc(result['amount'], totals['amount__sum'])
+        result['amount_selling_perc'] = _perc(result['price_selling_amount'], totals['price_selling__sum'])
+
+        return result
+
+    def iter_sales_report(self, report, year, query, chunk_size=2000):
+        """
+        yield the rows of one of the `SALES_REPORTS`, reading the grouped rows with a server side cursor
+        """
+        groups, query_fields, profit = SALES_REPORTS[report]
         totals = self.get_totals(year)
+        rows = self.get_sales_rows(year, groups, query_fields, query)
 
-        customers = {}
+        for row in rows.iterator(chunk_size=chunk_size):
+            yield self.get_sales_row(row, totals, profit=profit)
 
-        filter_q = Q(product_relation__in=Subquery(self.queryset.values('id')),
-                     order__order_type='sales', order__start_date__year=year)
+    def get_sales_report(self, report, year, query, image_size=None, image_format=None):
+        return report_cache.get_or_compute(
+            report, year, query,
+            lambda: self.build_sales_report(report, year, query, image_size, image_format),
+            variant='%s-%s' % (image_size, image_format) if image_size else None
+        )
 
-        if query:
-            filter_q = filter_q & Q(order__order_name__icontains=query)
+    def build_sales_report(self, report, year, query, image_size=None, image_format=None):
+        groups, query_fields, profit = SALES_REPORTS[report]
+        totals = self.get_totals(year)
+        rows = list(self.get_sales_rows(year, groups, query_fields, query))
+        image_urls = None
+
+        if image_size and 'product' in groups:
+            image_urls = thumbnails.get_urls([row['report_product'] for row in rows], image_size, image_format)
+
+        return [self.get_sales_row(row, totals, profit=profit, image_urls=image_urls) for row in rows]
+
+    def get_total_sales(self, year, query, image_size=None, image_format=None):
+        return self.get_sales_report('total_sales', year, query, image_size, image_format)
+
+    def get_total_sales_per_customer(self, year, query):
+        return self.get_sales_report('total_sales_per_customer', year, query)
+
+    def get_total_sales_per_product_customer(self, year, query, image_size=None, image_format=None):
+        return self.get_sales_report('total_sales_per_product_customer', year, query, image_size, image_format)
+
+
+class SalesReport(ProductQueryMixin):
+    queryset = models.Product.objects.all()
 
-        for orderline in OrderLine.objects.filter(filter_q).select_related('order').select_related('product_relation'):
-            if orderline.order.customer_id in customers:
-                customers[orderline.order.customer_id]['amount'] += orderline.amount
-                customers[orderline.order.customer_id]['price_purchase_amount'] += orderline.price_purchase.amount
-                customers[orderline.order.customer_id]['price_selling_amount'] += orderline.price_selling.amount
-            else:
-                customers[orderline.order.customer_id] = {
-                    'order_name': orderline.order.order_name,
-                    'amount': orderline.amount,
-                    'price_purchase_amount': orderline.price_purchase.amount,
-                    'price_purchase_currency': '%s' % orderline.price_purchase.currency,
-                    'price_selling_amount': orderline.price_selling.amount,
-                    'price_selling_currency': '%s' % orderline.price_selling.currency,
-                }
-
-        response = []
-
-        for key in customers.keys():
-            profit = round(customers[key]['price_selling_amount'] - customers[key]['price_purchase_amount'], 2)
-            customers[key]['profit'] = profit
-
-            customers[key]['amount_perc'] = round((customers[key]['amount'] / totals['amount__sum']) * 100, 2)
-            customers[key]['amount_selling_perc'] = round(
-                (customers[key]['price_selling_amount'] / totals['price_selling__sum']) * 100, 2
-            )
 
-            response.append(customers[key])
+def compute_sales_report(report, year, query, image_size=None, image_format=None):
+    return SalesReport().get_sales_report(report, year, query, image_size, image_format)
 
-        return sorted(response, key=itemgetter('price_selling_amount'), reverse=True)
 
+def get_job_status(job, request):
+    return {
+        'id': job['id'],
+        'status': job['status'],
+        'created': job['created'],
+        'finished': job['finished'],
+        'href': reverse('purchase-report-job-detail', kwargs={'pk': job['id']}, request=request),
+        'download': reverse('purchase-report-job-download', kwargs={'pk': job['id']}, request=request),
+    }
 
-class ExportXlsView(ProductQueryMixin, XLSXFileMixin, BaseListView):
+
+class ExportXlsView(metrics.MetricsMixin, ProductQueryMixin, XLSXFileMixin, BaseListView):
     pagination_class = None
     renderer_classes = (XLSXRenderer,)
     filename = 'total_sales_per_customer.xlsx'
@@ -139,8 +264,153 @@ class ExportXlsView(ProductQueryMixin, XLSXFileMixin, BaseListView):
 
         return self.get_total_sales_per_customer(year, query)
 
+    def list(self, request, *args, **kwargs):
+        """
+        ?stream=1 writes the rows straight from the database cursor into a streamed workbook
+        """
+        if not is_flag_set(request, 'stream'):
+            return super().list(request, *args, **kwargs)
+
+        now = datetime.datetime.now()
+        year = self.request.GET.get('year', now.year)
+
+        query = self.request.query_params.get('q')
+
+        rows = self.iter_sales_report('total_sales_per_customer', year, query)
+        headers = list(self.get_serializer_class()().fields.keys())
+
+        return exports.xlsx_response(self.filename, headers, rows)
+
+
+def get_product_autocomplete_row(product):
+    image = '%s%s' % (settings.MEDIA_URL, product.image.name) if product.image else ''
+
+    return {
+        'id': product.id,
+        'identifier': product.identifier,
+        'name': product.name,
+        'value': '%s (%s)' % (product, product.unit),
+        'price_purchase': '%s' % product.price_purchase,
+        'price_selling': '%s' % product.price_selling,
+        'price_selling_alt': '%s' % product.price_selling_alt,
+        'image': image
+    }
+
+
+SUPPLIER_AUTOCOMPLETE_FIELDS = ('id', 'name', 'postal', 'city', 'country_code', 'tel', 'mobile', 'email',
+                                'identifier', 'contact', 'remarks', 'value')
+SUPPLIER_VALUE_FIELDS = ('identifier', 'name', 'city', 'country_code')
+
+
+def get_supplier_autocomplete_fields(request):
+    """
+    the fields asked for with ?fields=, all of them by default
+    """
+    fields = request.query_params.get('fields')
+    if not fields:
+        return SUPPLIER_AUTOCOMPLETE_FIELDS
+
+    fields = [field.strip() for field in fields.split(',')]
+
+    return ('id',) + tuple(field for field in SUPPLIER_AUTOCOMPLETE_FIELDS if field in fields and field != 'id')
+
+
+def get_supplier_autocomplete_columns(fields):
+    columns = set(field for field in fields if field != 'value')
+
+    if 'value' in fields:
+        columns.update(SUPPLIER_VALUE_FIELDS)
+
+    return columns
+
+
+def get_supplier_autocomplete_row(supplier, fields=SUPPLIER_AUTOCOMPLETE_FIELDS):
+    """
+    supplier is a Supplier or a dict with at least the columns needed for fields
+    """
+    if not isinstance(supplier, dict):
+        supplier = {column: getattr(supplier, column) for column in get_supplier_autocomplete_columns(fields)}
+
+    row = {}
+    for field in fields:
+        if field == 'value':
+            row['value'] = '(%s) %s, %s (%s)' % tuple(supplier[column] for column in SUPPLIER_VALUE_FIELDS)
+        else:
+            row[field] = supplier[field]
+
+    return row
+
+
+class DeltaSyncMixin(object):
+    """
+    `changes` action for device clients: rows modified and deleted since the token of the previous call
+    """
+    sync_token_query_param = 'since'
+
+    def get_sync_since(self, request):
+        token = request.query_params.get(self.sync_token_query_param)
+        if not token:
+            return None
+
+        try:
+            return sync.parse_token(token)
+        except sync.InvalidToken:
+            raise ValidationError({self.sync_token_query_param: 'invalid sync token'})
+
+    sync_page_size = 500
+
+    def get_sync_paginator(self):
+        paginator = self.cursor_pagination_class()
+        paginator.page_size = self.sync_page_size
+
+        return paginator
+
+    @action(detail=False, methods=['GET'])
+    def changes(self, request, *args, **kwargs):
+        """
+        without `since` this returns everything, a page at a time: follow `next` until it is None, the last
+        page has the deleted ids and the token to pass as `since` next time
+        """
+        # taken before reading, so rows changed while we read are sent again next time
+        token = sync.make_token()
+
+        try:
+            since = self.get_sync_since(request)
+        except sync.ExpiredToken:
+            return Response(
+                {'detail': 'sync token expired, do a full sync'},
+                status=status.HTTP_410_GONE
+            )
+
+        queryset = self.filter_queryset(self.get_queryset())
+        if since is not None:
+            queryset = queryset.filter(modified__gte=since)
+
+        # rows modified while the client pages move behind the cursor, so they are still sent
+        paginator = self.get_sync_paginator()
+        page = paginator.paginate_queryset(queryset.order_by('modified', 'pk'), request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        next_link = paginator.get_next_link()
+
+        if next_link is not None:
+            return Response({'next': next_link, 'results': serializer.data, 'deleted': [], 'token': None})
+
+        deleted = []
+        if since is not None:
+            deleted = list(models.SyncTombstone.objects.filter(
+                model=self.model._meta.label_lower,
+                deleted__gte=since
+            ).order_by('deleted').values_list('object_id', flat=True))
+
+        return Response({
+            'next': None,
+            'results': serializer.data,
+            'deleted': deleted,
+            'token': token,
+        })
 
-class ProductViewset(ProductQueryMixin, BaseMy24ViewSet):
+
+class ProductViewset(metrics.MetricsMixin, DeltaSyncMixin, ProductQueryMixin, BaseMy24ViewSet):
     serializer_class = serializers.ProductSerializer
     serializer_detail_class = serializers.ProductSerializer
     permission_classes = (
@@ -149,147 +419,146 @@ class ProductViewset(ProductQueryMixin, BaseMy24ViewSet):
         permissions.IsCustomerUser |
         permissions.IsSalesUser,)
     renderer_classes = (renderers.JSONRenderer, renderers.BrowsableAPIRenderer)
+    parser_classes = (parsers.JSONParser, parsers.MultiPartParser, parsers.FormParser)
     paginate_by = 20
     filterset_fields = ('product_type',)
     search_fields = ('identifier', 'name', 'search_name', 'unit', 'supplier', 'product_type')
+    conditional_get = True
     queryset = models.Product.objects.all()
     model = models.Product
 
+    def initialize_request(self, request, *args, **kwargs):
+        # write uploaded images to a temporary file chunk by chunk, storage then moves or streams that file
+        if not hasattr(request, '_files'):
+            request.upload_handlers = [TemporaryFileUploadHandler(request)]
+
+        return super().initialize_request(request, *args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        image_size, image_format = thumbnails.get_request_options(self.request)
+
+        if image_size and self.action in ('list', 'retrieve', 'changes'):
+            queryset = queryset.prefetch_related(Prefetch(
+                'image_derivatives',
+                queryset=models.ProductImageDerivative.objects.filter(size=image_size, format=image_format),
+                to_attr='image_thumbnails'
+            ))
+
+        return queryset
+
     @action(detail=False, methods=['GET'])
     def autocomplete(self, request, *args, **kwargs):
         query = self.request.query_params.get('q')
 
-        data = []
-        qs = self.queryset
-        qs = qs.filter(
-            Q(identifier__icontains=query) |
-            Q(name__icontains=query) |
-            Q(name_short__icontains=query) |
-            Q(search_name__icontains=query) |
-            Q(unit__icontains=query) |
-            Q(supplier__icontains=query) |
-            Q(product_type__icontains=query)
-        )
+        if not query:
+            return Response([])
 
-        for product in qs:
-            image = '%s%s' % (settings.MEDIA_URL, product.image.name) if product.image else ''
-            data.append({
-                'id': product.id,
-                'identifier': product.identifier,
-                'name': product.name,
-                'value': '%s (%s)' % (product, product.unit),
-                'price_purchase': '%s' % product.price_purchase,
-                'price_selling': '%s' % product.price_selling,
-                'price_selling_alt': '%s' % product.price_selling_alt,
-                'image': image
-            })
+        if autocomplete_index.is_enabled():
+            rows = autocomplete_index.search(models.Product, query, search.get_limit(request))
+        else:
+            qs = search.search(self.queryset, search.PRODUCT_SEARCH_FIELDS, query, search.get_limit(request))
+            rows = [get_product_autocomplete_row(product) for product in qs]
 
-        return Response(data)
+        image_size, image_format = thumbnails.get_request_options(request)
+        if image_size:
+            image_urls = thumbnails.get_urls([row['id'] for row in rows], image_size, image_format)
+            # index rows are shared, replace the image in a copy
+            rows = [dict(row, image=image_urls[row['id']]) if row['id'] in image_urls else row for row in rows]
 
-    def get_totals(self, year):
-        filter_q = Q(product_relation__in=Subquery(self.queryset.values('id')),
-                     order__order_type='sales', order__start_date__year=year)
+        return Response(rows)
 
-        return OrderLine.objects.filter(filter_q).aggregate(Sum('price_selling'), Sum('amount'), Sum('price_purchase'))
-
-    @action(detail=False, methods=['GET'])
-    def total_sales(self, request, *args, **kwargs):
+    def get_report_response(self, report):
         """
-        total sales per product
+        the report rows, or with ?async=1 a job that computes them in the background
         """
         now = datetime.datetime.now()
         year = self.request.GET.get('year', now.year)
 
         query = self.request.query_params.get('q')
+        image_size, image_format = thumbnails.get_request_options(self.request)
 
-        response = self.get_total_sales(year, query)
+        if is_flag_set(self.request, 'async'):
+            job = jobs.submit(
+                compute_sales_report, report, year, query, image_size, image_format,
+                user=self.request.user
+            )
+
+            return Response(
+                get_job_status(job, self.request),
+                status=status.HTTP_202_ACCEPTED
+            )
 
         return Response({
-            'result': response,
+            'result': self.get_sales_report(report, year, query, image_size, image_format),
             'num_pages': 1
         })
 
+    @action(detail=False, methods=['GET'])
+    def total_sales(self, request, *args, **kwargs):
+        """
+        total sales per product
+        """
+        return self.get_report_response('total_sales')
+
     @action(detail=False, methods=['GET'])
     def total_sales_per_customer(self, request, *args, **kwargs):
         """
         group product sales per customer and totalize
         """
-        now = datetime.datetime.now()
-        year = self.request.GET.get('year', now.year)
-
-        query = self.request.query_params.get('q')
-
-        response_data = self.get_total_sales_per_customer(year, query)
-
-        return Response({
-            'result': response_data,
-            'num_pages': 1
-        })
+        return self.get_report_response('total_sales_per_customer')
 
     @action(detail=False, methods=['GET'])
     def total_sales_per_product_customer(self, request, *args, **kwargs):
         """
         group product sales per customer and totalize
         """
-        now = datetime.datetime.now()
-        year = self.request.GET.get('year', now.year)
+        return self.get_report_response('total_sales_per_product_customer')
 
-        totals = self.get_totals(year)
 
-        query = self.request.query_params.get('q')
+class ReportJobViewset(metrics.MetricsMixin, viewsets.ViewSet):
+    """
+    status and result of report jobs started with ?async=1
+    """
+    permission_classes = ProductViewset.permission_classes
 
-        customer_products = {}
+    def get_job(self, pk):
+        job = jobs.get_job(pk, user=self.request.user)
 
-        filter_q = Q(product_relation__in=Subquery(self.queryset.values('id')),
-                     order__order_type='sales', order__start_date__year=year)
+        if job is None:
+            raise Http404
 
-        if query:
-            filter_q = filter_q & (Q(order__order_name__icontains=query) | Q(product_relation__name__icontains=query))
+        return job
 
-        for orderline in OrderLine.objects.filter(filter_q).select_related('order').select_related('product_relation'):
-            key = '%s-%s' % (orderline.order.customer_id, orderline.product_relation.id)
+    def retrieve(self, request, pk=None):
+        job = self.get_job(pk)
+        data = get_job_status(job, request)
 
-            if key in customer_products:
-                customer_products[key]['amount'] += orderline.amount
-                customer_products[key]['price_purchase_amount'] += orderline.price_purchase.amount
-                customer_products[key]['price_selling_amount'] += orderline.price_selling.amount
-            else:
-                customer_products[key] = {
-                    'product_image': orderline.product_relation.image.url if orderline.product_relation.image else '',
-                    'product_name': orderline.product_relation.name,
-                    'order_name': orderline.order.order_name,
-                    'amount': orderline.amount,
-                    'price_purchase_amount': orderline.price_purchase.amount,
-                    'price_purchase_currency': '%s' % orderline.price_purchase.currency,
-                    'price_selling_amount': orderline.price_selling.amount,
-                    'price_selling_currency': '%s' % orderline.price_selling.currency,
-                }
-
-        response = []
-
-        for key in customer_products.keys():
-            customer_products[key]['amount_perc'] = round(
-                (customer_products[key]['amount'] / totals['amount__sum']) * 100, 2
-            )
-            customer_products[key]['amount_selling_perc'] = round(
-                (customer_products[key]['price_selling_amount'] / totals['price_selling__sum']) * 100, 2
-            )
+        if job['status'] == jobs.DONE:
+            data['result'] = job['result']
+            data['num_pages'] = 1
 
-            response.append(customer_products[key])
+        return Response(data)
 
-        response = sorted(response, key=itemgetter('price_selling_amount'), reverse=True)
+    @action(detail=True, methods=['GET'])
+    def download(self, request, pk=None):
+        job = self.get_job(pk)
 
-        return Response({
-            'result': response,
-            'num_pages': 1
-        })
+        if job['status'] != jobs.DONE:
+            return Response(get_job_status(job, request), status=status.HTTP_409_CONFLICT)
 
+        rows = job['result']
+        headers = list(rows[0].keys()) if rows else []
 
-class SupplierViewset(BaseMy24ViewSet):
+        return exports.xlsx_response('report-%s.xlsx' % job['id'], headers, rows)
+
+
+class SupplierViewset(metrics.MetricsMixin, BaseMy24ViewSet):
     serializer_class = serializers.SupplierSerializer
     serializer_detail_class = serializers.SupplierSerializer
     permission_classes = (permissions.IsPlanningUser,)
     search_fields = ('name', 'city', 'identifier', 'email')
+    conditional_get = True
     queryset = models.Supplier.objects.all()
     model = models.Supplier
 
@@ -297,60 +566,65 @@ class SupplierViewset(BaseMy24ViewSet):
     def autocomplete(self, request, *args, **kwargs):
         query = self.request.query_params.get('q')
 
-        data = []
-        qs = self.queryset
-        qs = qs.filter(
-            Q(name__icontains=query) |
-            Q(address__icontains=query) |
-            Q(city__icontains=query) |
-            Q(email__icontains=query)
-        )
+        if not query:
+            return Response([])
 
-        for supplier in qs:
-            value = '(%s) %s, %s (%s)' % (supplier.identifier, supplier.name, supplier.city, supplier.country_code)
+        fields = get_supplier_autocomplete_fields(request)
+        limit = search.get_limit(request)
 
-            data.append({
-                'id': supplier.id,
-                'name': supplier.name,
-                'postal': supplier.postal,
-                'city': supplier.city,
-                'country_code': supplier.country_code,
-                'tel': supplier.tel,
-                'mobile': supplier.mobile,
-                'email': supplier.email,
-                'identifier': supplier.identifier,
-                'contact': supplier.contact,
-                'remarks': supplier.remarks,
-                'value': value
-            })
+        if autocomplete_index.is_enabled():
+            rows = autocomplete_index.search(models.Supplier, query, limit)
 
-        return Response(data)
+            return Response([{field: row[field] for field in fields} for row in rows])
+
+        qs = self.queryset.values(*get_supplier_autocomplete_columns(fields))
+        qs = search.search(qs, search.SUPPLIER_SEARCH_FIELDS, query, limit)
+
+        return Response([get_supplier_autocomplete_row(supplier, fields) for supplier in qs])
 
 
-class StockLocationViewset(BaseMy24ViewSet):
+class StockLocationViewset(metrics.MetricsMixin, DeltaSyncMixin, BaseMy24ViewSet):
     serializer_class = serializers.StockLocationSerializer
     serializer_detail_class = serializers.StockLocationSerializer
     permission_classes = (permissions.IsPlanningUser,)
     search_fields = ('identifier', 'name')
+    conditional_get = True
     queryset = models.StockLocation.objects.all()
     model = models.StockLocation
 
 
-class StockMutationViewset(BaseMy24ViewSet):
+class StockMutationViewset(metrics.MetricsMixin, BaseMy24ViewSet):
     serializer_class = serializers.StockMutationSerializer
     serializer_detail_class = serializers.StockMutationSerializer
     permission_classes = (permissions.IsPlanningUser | permissions.IsSalesUser,)
-    queryset = models.StockMutation.objects.select_related('product').all()
+    queryset = models.StockMutation.objects.select_related('product', 'fromLocation', 'toLocation').all()
     model = models.StockMutation
+    estimate_count_threshold = 100000
+    conditional_get = True
+    conditional_get_related = ('product', 'fromLocation', 'toLocation')
+
+    @action(detail=False, methods=['POST'])
+    def bulk(self, request, *args, **kwargs):
+        """
+        create a list of mutations in one go
+        """
+        serializer = serializers.StockMutationBulkSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        mutations = serializer.save()
 
+        return Response({'count': len(mutations)}, status=status.HTTP_201_CREATED)
 
-class StockLocationInventoryViewset(BaseMy24ViewSet):
+
+class StockLocationInventoryViewset(metrics.MetricsMixin, DeltaSyncMixin, BaseMy24ViewSet):
     serializer_class = serializers.StockLocationInventorySerializer
     serializer_detail_class = serializers.StockLocationInventorySerializer
     permission_classes = (permissions.IsPlanningUser | permissions.IsSalesUser,)
     search_fields = ('product__name', 'location__name')
     filterset_fields = ('product', 'location')
     page_size = 200
+    sparse_fieldset_actions = ('list', 'retrieve', 'list_full')
+    conditional_get = True
+    conditional_get_related = ('product', 'location')
     queryset = models.StockLocationInventory. \
         objects. \
         select_related('product', 'location'). \
@@ -358,6 +632,86 @@ class StockLocationInventoryViewset(BaseMy24ViewSet):
         all()
     model = models.StockLocationInventory
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        image_size, image_format = thumbnails.get_request_options(self.request)
+
+        # the nested products of list_full show their thumbnail
+        if image_size and self.action == 'list_full':
+            queryset = queryset.prefetch_related(Prefetch(
+                'product__image_derivatives',
+                queryset=models.ProductImageDerivative.objects.filter(size=image_size, format=image_format),
+                to_attr='image_thumbnails'
+            ))
+
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('as_of'):
+            return self.list_as_of(request)
+
+        return super().list(request, *args, **kwargs)
+
+    def get_as_of(self, request):
+        value = request.query_params.get('as_of')
+        error = ValidationError({'as_of': ['Use a date (YYYY-MM-DD) or a datetime.']})
+
+        try:
+            # well formed but impossible values, like 2024-02-30, raise ValueError
+            when = parse_datetime(value)
+            day = parse_date(value) if when is None else None
+        except ValueError:
+            raise error
+
+        if when is None:
+            if day is None:
+                raise error
+
+            when = datetime.datetime.combine(day, datetime.time.max)
+
+        if settings.USE_TZ and timezone.is_naive(when):
+            when = timezone.make_aware(when)
+
+        return when
+
+    def get_as_of_id(self, request, name):
+        value = request.query_params.get(name)
+        if not value:
+            return None
+
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({name: ['A valid integer is required.']})
+
+    def list_as_of(self, request):
+        """
+        the inventory at ?as_of=, from the nearest snapshot plus the mutations after it
+        """
+        if self.get_pagination_mode() == 'cursor':
+            # the rows are computed, there is no ordered column to put in a cursor
+            raise ValidationError({self.pagination_mode_query_param: ['Use page pagination with as_of.']})
+
+        amounts = models.StockInventorySnapshot.objects.get_amounts_at(
+            self.get_as_of(request),
+            product_id=self.get_as_of_id(request, 'product'),
+            location_id=self.get_as_of_id(request, 'location'),
+        )
+
+        keys = sorted(amounts.keys(), key=lambda key: (key[0] or 0, key[1] or 0))
+
+        rows = [{
+            'product': product_id,
+            'location': location_id,
+            'amount': amounts[(product_id, location_id)],
+        } for product_id, location_id in keys]
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(page)
+
+        return Response(rows)
+
     def get_serializer_class(self):
         if self.action == 'list':
             return serializers.StockLocationInventorySerializer
@@ -366,9 +720,43 @@ class StockLocationInventoryViewset(BaseMy24ViewSet):
 
         return serializers.StockLocationInventorySerializer
 
+    def get_sales_amount_today(self, inventories):
+        """
+        today's sales amount per (location_id, product_id) of the inventories, in one grouped query
+        """
+        if not inventories:
+            return {}
+
+        rows = OrderLine.objects.\
+            filter(
+                location_relation_id__in=set(inventory.location_id for inventory in inventories),
+                product_relation_id__in=set(inventory.product_id for inventory in inventories),
+                order__start_date=datetime.date.today(),
+                order__order_type='sales'
+            ).\
+            order_by().\
+            values_list('location_relation', 'product_relation').\
+            annotate(total=Sum('amount'))
+
+        return {(location_id, product_id): total for location_id, product_id, total in rows}
+
     @action(detail=False, methods=['GET'])
     def list_full(self, request, *args, **kwargs):
-        return super().list(request, args, kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        inventories = list(page if page is not None else queryset)
+
+        context = self.get_serializer_context()
+        serializer = self.get_serializer_class()(inventories, many=True, context=context)
+
+        if 'sales_amount_today' in serializer.child.fields:
+            context['sales_amount_today'] = self.get_sales_amount_today(inventories)
+
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+
+        return Response(serializer.data)
 
     @action(detail=False, methods=['GET'])
     def list_product_types(self, request, *args, **kwargs):
@@ -384,3 +772,13 @@ class StockLocationInventoryViewset(BaseMy24ViewSet):
             })
 
         return Response(data)
+
+
+class MetricsViewset(viewsets.ViewSet):
+    """
+    request metrics of the purchase viewsets in the prometheus text format
+    """
+    permission_classes = (metrics.MetricsPermission,)
+
+    def list(self, request):
+        return metrics.metrics_response(request)